@@ -4,15 +4,22 @@ import logging
 from datetime import timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from utilities import *
+from DataAnalysis.utilities import *
+from DataAnalysis.sharding import WorkQueue, run_worker
+from DataAnalysis.caching import MetricFieldCache, content_key
 
 
 class AnalysisBuilder(object):
     metrics_build_plan = None
+    station_columns = ['FF_10']
 
-    def __int__(self, parameters: dict) -> None:
+    # (time, Y, X) float arrays alive per hour of a chunk: shared ones plus the ones of each active metric,
+    # the TRY month itself is opened lazily and only read per chunk
+    base_arrays = 1
+    arrays_per_metric = 2
+
+    def __init__(self, parameters: dict) -> None:
         try:
-            self.max_time_step = int(timedelta(days=parameters['max_days']).total_seconds())
             self.con = parameters['connection']
             self.try_path = parameters['TRY_path']
             self.result_path = parameters['result_path']
@@ -27,6 +34,18 @@ class AnalysisBuilder(object):
         else:
             self.thread_count = 8
 
+        if 'max_days' in parameters:
+            self.max_days = parameters['max_days']
+        else:
+            self.max_days = None
+
+        if 'raw_station_data' in parameters:
+            self.raw_station_data = parameters['raw_station_data']
+        else:
+            self.raw_station_data = False
+
+        self.all_tables = set(getAllTables(connection=self.con))
+
         self.description = pd.read_sql(sql=f'SELECT Stations_id, geoBreite, geoLaenge FROM Beschreibung_Stationen',
                                        con=self.con)
 
@@ -59,7 +78,7 @@ class AnalysisBuilder(object):
                     case 'RMSE':
                         return calc_root_mean_square_deviation
                     case _:
-                        raise ''
+                        raise ValueError(f'Unknown metric {m_}')
 
             if len(str_split) == 1:
                 return [None] + second_level_func(m)
@@ -71,7 +90,7 @@ class AnalysisBuilder(object):
                 elif str_split[0] == 'std':
                     return [np.nanstd, sub_first_level_fuc(str_split[1])]
                 else:
-                    raise ''
+                    raise ValueError(f'Unknown metric {m}')
 
         def second_level_func(m: str) -> list:
             if m[:2] == 'RM':
@@ -79,7 +98,7 @@ class AnalysisBuilder(object):
             elif m[0] == 'M':
                 return [np.nanmean] + third_level_func(m[1:])
             else:
-                raise ''
+                raise ValueError(f'Unknown metric {m}')
 
         def third_level_func(m: str) -> list:
             match m:
@@ -90,7 +109,7 @@ class AnalysisBuilder(object):
                 case 'SE':
                     return [calc_square_deviation]
                 case _:
-                    raise ''
+                    raise ValueError(f'Unknown metric {m}')
 
         result = {}
         for metric in metrics:
@@ -101,76 +120,225 @@ class AnalysisBuilder(object):
 
         return result
 
-    def run_analysis(self, func, after_each_station=None, **kwargs):
-        self.metrics_build_plan = self.build_metrics(kwargs['metrics'])
+    def prepare_metrics(self, metrics: list) -> None:
+        self.metrics_build_plan = self.build_metrics(metrics)
 
-        for try_file in sorted(os.listdir(path=self.try_path)):
-            time_start, time_end = self.calc_time_step(try_filename=try_file)
+    def estimate_cells(self, func_param: dict, kwargs: dict) -> int:
+        return func_param['ds'].sizes.get('Y') * func_param['ds'].sizes.get('X')
 
-            try:
-                ds_try = xr.load_dataset(self.try_path + try_file)
+    def calc_chunk_hours(self, func_param: dict, kwargs: dict) -> int:
+        memory_budget = kwargs.get('memory_budget')
 
-                for i, table in enumerate(self.station_tables):
-                    df = pd.read_sql(sql=f'SELECT STATIONS_ID, time, FF_10 FROM {table}', con=self.con)
-                    df['FF_10'] = df['FF_10'].replace(to_replace=-999.0, value=np.nan)
-                    df['time'] = pd.to_datetime(df['time'])
-                    df.set_index(keys='time', drop=True, inplace=True)
-                    df = df.groupby(pd.Grouper(freq='H')).mean()
+        if memory_budget is None:
+            if self.max_days is None:
+                return 24 * 31
+            return max(1, int(self.max_days * 24))
+
+        itemsize = np.result_type(func_param['ds']['FF'].dtype, np.float64).itemsize
+        arrays = self.base_arrays + self.arrays_per_metric * len(self.metrics_build_plan)
+        bytes_per_hour = self.estimate_cells(func_param=func_param, kwargs=kwargs) * itemsize * arrays
+
+        return max(1, int(memory_budget // bytes_per_hour))
+
+    def load_station(self, table: str, time_start: np.datetime64, time_end: np.datetime64) -> pd.DataFrame:
+        # the hourly table is written at ingest, the 10-minute rows are only read if asked or if it is missing
+        hourly = not self.raw_station_data and f'{table}_hourly' in self.all_tables
+        source = f'{table}_hourly' if hourly else table
+
+        # only the rows of the hours time_start to time_end, timestamps are UTC seconds
+        bounds = [int((time - np.datetime64('1970-01-01T00:00:00')) // np.timedelta64(1, 's'))
+                  for time in [time_start, time_end + np.timedelta64(1, 'h')]]
+
+        df = pd.read_sql(sql=f'SELECT STATIONS_ID, time, {", ".join(self.station_columns)} FROM {source} '
+                             f'WHERE timestamp >= ? AND timestamp < ?',
+                         con=self.con, params=bounds)
+        df['time'] = pd.to_datetime(df['time'])
+        df.set_index(keys='time', drop=True, inplace=True)
+
+        if not hourly:
+            df = station_to_hourly(df=df)
 
-                    station_id = int(df['STATIONS_ID'].iloc[0])
+        return df
 
-                    lon = self.description['geoLaenge'].loc[station_id]
-                    lat = self.description['geoBreite'].loc[station_id]
+    def analyze_station(self, func, after_each_station, ds_try: xr.Dataset, try_file: str, table: str, kwargs: dict):
+        time_start, time_end = self.calc_time_step(try_filename=try_file)
 
-                    df.drop(columns=['STATIONS_ID'], inplace=True)
+        df = self.load_station(table=table, time_start=time_start, time_end=time_end)
 
-                    dict_station_result = {}
+        # a station without rows in the month is a normal unit with no result
+        if df.empty:
+            return None
 
-                    flag = True
-                    start = time_start
-                    stop = start + self.max_time_step
-                    while flag:
-                        if stop > time_end:
-                            stop = time_end
-                            flag = False
+        station_id = int(df['STATIONS_ID'].iloc[0])
 
-                        df_tmp = df.loc[start:stop]
-                        if df_tmp.empty:
-                            flag = False
-                            continue
+        lon = self.description['geoLaenge'].loc[station_id]
+        lat = self.description['geoBreite'].loc[station_id]
 
-                        func_param = dict(ds=ds_try,
-                                          df=df_tmp,
-                                          longitude=lon,
-                                          latitude=lat,
-                                          )
+        df.drop(columns=['STATIONS_ID'], inplace=True)
 
-                        dict_tmp_result = func(func_param, kwargs)
+        dict_station_result = {}
 
-                        if dict_station_result:
-                            for key, value in dict_tmp_result.items():
-                                dict_station_result[key] = np.concatenate((dict_station_result[key], value))
-                        else:
-                            dict_station_result = dict_tmp_result
+        func_param = dict(ds=ds_try,
+                          longitude=lon,
+                          latitude=lat,
+                          station_id=station_id,
+                          )
 
-                    if after_each_station is not None:
-                        after_each_station(dict_station_result, kwargs)
+        chunk_hours = self.calc_chunk_hours(func_param=func_param, kwargs=kwargs)
+        chunk_count = int(np.ceil(((time_end - time_start) // np.timedelta64(1, 'h') + 1) / chunk_hours))
+        logging.info(f'analyze_station() -> {table} {try_file}: {chunk_count} chunks of {chunk_hours} h')
+
+        one_hour = np.timedelta64(1, 'h')
+        start = time_start
+        while start <= time_end:
+            stop = min(start + chunk_hours * one_hour - one_hour, time_end)
+
+            df_tmp = df.loc[start:stop]
+            start = stop + one_hour
+
+            if df_tmp.empty:
+                continue
+
+            func_param = dict(func_param, df=df_tmp)
+
+            dict_tmp_result = func(func_param, kwargs)
+
+            if dict_station_result:
+                for key, value in dict_tmp_result.items():
+                    dict_station_result[key] = np.concatenate((dict_station_result[key], value))
+            else:
+                dict_station_result = dict_tmp_result
+
+        if after_each_station is not None:
+            return after_each_station(dict_station_result, kwargs)
+
+        return None
+
+    def run_analysis(self, func, after_each_station=None, **kwargs) -> int:
+        # the results of all units are written once to result_path, returns the number of failed units
+        self.prepare_metrics(metrics=kwargs['metrics'])
+
+        results = []
+        failed = 0
+        for try_file in sorted(os.listdir(path=self.try_path)):
+            try:
+                ds_try = xr.open_dataset(self.try_path + try_file)
 
             except Exception as e:
-                logging.error(f'plot_multiple_stations_time() -> {e}')
+                logging.error(f'run_analysis() -> {try_file}: {e}')
+                failed += len(self.station_tables)
                 continue
 
+            with ds_try:
+                for i, table in enumerate(self.station_tables):
+                    try:
+                        df_result = self.analyze_station(func, after_each_station, ds_try, try_file, table, kwargs)
+
+                    except Exception as e:
+                        logging.error(f'run_analysis() -> {table}/{try_file}: {e}')
+                        failed += 1
+                        continue
+
+                    if df_result is not None:
+                        df_result.insert(0, 'try_file', try_file)
+                        df_result.insert(0, 'station_table', table)
+                        results.append(df_result)
+
+        df_results = pd.concat(objs=results, ignore_index=True) if results else pd.DataFrame()
+        df_results.to_feather(path=kwargs.get('result_path', self.result_path))
+
+        return failed
+
+    def run_sharded(self, func, after_each_station=None, shard_dir: str = None, worker: str = None, **kwargs) -> int:
+        # one work unit is one (station table, TRY file) pair, each unit writes its own result file into shard_dir
+        self.prepare_metrics(metrics=kwargs['metrics'])
+
+        queue = WorkQueue(shard_dir=shard_dir)
+        queue.populate(station_tables=self.station_tables, try_files=sorted(os.listdir(path=self.try_path)))
+
+        loaded = {}
+
+        def run_unit(table: str, try_file: str, result_path: str) -> bool:
+            # units are claimed ordered by TRY file, so consecutive units mostly reuse the loaded month
+            if try_file not in loaded:
+                for ds in loaded.values():
+                    ds.close()
+                loaded.clear()
+                loaded[try_file] = xr.open_dataset(self.try_path + try_file)
+
+            df_result = self.analyze_station(func, after_each_station, loaded[try_file], try_file, table, kwargs)
+            if df_result is None:
+                return False
+
+            df_result.to_feather(path=result_path)
+            return True
+
+        try:
+            return run_worker(queue=queue, run_unit=run_unit, worker=worker)
+
+        finally:
+            for ds in loaded.values():
+                ds.close()
+
 
 class SpatialAnalysis(AnalysisBuilder):
     _ds_station_grid: xr.Dataset = None
-    _total_area_metrics: dict = {}
+    _total_area_metrics: dict = None
+    _windows: dict = None
+    _station_xy: tuple = None
+
+    # window of FF, pre_calc copies of FF and station grid, station grid list, array and masked copy;
+    # per metric the deviation list, its array and the finite copy
+    base_arrays = 6
+    arrays_per_metric = 3
+
+    # field function of the plan -> (per time step deviation, applied to its per cell time mean)
+    _field_bases = {calc_mean_absolute_deviation: (calc_absolute_deviation, []),
+                    calc_mean_absolute_percentage_deviation: (calc_absolute_percentage_deviation, []),
+                    calc_mean_square_deviation: (calc_square_deviation, []),
+                    calc_root_mean_square_deviation: (calc_square_deviation, [np.sqrt]),
+                    calc_absolute_deviation: (calc_absolute_deviation, []),
+                    calc_absolute_percentage_deviation: (calc_absolute_percentage_deviation, []),
+                    calc_square_deviation: (calc_square_deviation, [])}
+
+    def __init__(self, parameters: dict) -> None:
+        super(SpatialAnalysis, self).__init__(parameters=parameters)
+
+        self._total_area_metrics = {}
+        self._windows = {}
+        self.metric_cache = MetricFieldCache(path=parameters.get('cache_path'),
+                                             max_memory_bytes=parameters.get('cache_memory_bytes', 512 * 2 ** 20),
+                                             max_disk_bytes=parameters.get('cache_disk_bytes', 8 * 2 ** 30))
+
+    def crop_to_station(self, func_param: dict, radius) -> (xr.Dataset, float, float):
+        key = (func_param['station_id'], grid_key(dwd_ds=func_param['ds']), radius)
+
+        if key not in self._windows:
+            x, y = to_coordinate(lat_station=func_param['latitude'], lon_station=func_param['longitude'],
+                                 dwd_ds=func_param['ds'])
+            self._windows[key] = (x, y, calc_window(dwd_ds=func_param['ds'], x=x, y=y, radius=radius))
 
-    def __int__(self, parameters: dict) -> None:
-        super(SpatialAnalysis, self).__int__(parameters=parameters)
+        x, y, window = self._windows[key]
 
-    def perform_ring_analysis(self, ring: tuple, keys: list[str], lon, lat) -> dict:
-        x, y = to_coordinate(lat_station=lat, lon_station=lon, dwd_ds=self._ds_station_grid)
+        return func_param['ds'].isel(window), x, y
 
+    @staticmethod
+    def align_chunk(func_param: dict, ds_window: xr.Dataset) -> (xr.DataArray, pd.DataFrame):
+        # only hours present in both the TRY window and the station series
+        times = np.intersect1d(ds_window['time'].values, func_param['df'].index.values)
+
+        return ds_window['FF'].sel(time=times), func_param['df'].loc[times]
+
+    @staticmethod
+    def field_radius(kwargs: dict):
+        # fields cover field_radius, a sweep setting it to its largest radius_end reuses them for every ring set
+        return max(kwargs.get('field_radius') or kwargs['radius_end'], kwargs['radius_end'])
+
+    def estimate_cells(self, func_param: dict, kwargs: dict) -> int:
+        ds_window, _, _ = self.crop_to_station(func_param=func_param, radius=self.field_radius(kwargs=kwargs))
+        return ds_window.sizes.get('Y') * ds_window.sizes.get('X')
+
+    def perform_ring_analysis(self, ring: tuple, keys: list[str], x, y) -> dict:
         outer_mask = calc_mask(dwd_ds=self._ds_station_grid, x=x, y=y, radius=ring[1])
 
         if ring[0] > 0:
@@ -182,74 +350,240 @@ class SpatialAnalysis(AnalysisBuilder):
         ring_result = {}
         for key in keys:
             masked = self._total_area_metrics[key].where(cond=mask, drop=True)
-            masked = np.asarray(masked[key])
+            masked = np.asarray(masked[list(masked.data_vars)[0]])
             masked = masked[~np.isnan(masked)]
 
             ring_result.update({key: masked})
 
         return ring_result
 
-    def spatial_analysis(self, func_param: dict, kwargs: dict) -> dict:
+    @staticmethod
+    def build_rings(kwargs: dict) -> np.ndarray:
         radius_ary = np.arange(kwargs['radius_start'], kwargs['radius_end'], kwargs['radius_step'])
-        rings = np.asarray([(inner, outer) for inner, outer in zip(radius_ary[:-1], radius_ary[1:])])
+        return np.asarray([(inner, outer) for inner, outer in zip(radius_ary[:-1], radius_ary[1:])])
+
+    def spatial_analysis(self, func_param: dict, kwargs: dict) -> dict:
+        field_radius = self.field_radius(kwargs=kwargs)
+        ds_window, x, y = self.crop_to_station(func_param=func_param, radius=field_radius)
+
+        # the ring masks only need the X/Y coordinates of the window
+        self._ds_station_grid = ds_window
+        self._station_xy = (x, y)
+
+        first, df = self.align_chunk(func_param=func_param, ds_window=ds_window)
+        station_grid = None
+
+        # the fields only depend on station, period, deviation and field radius, not on the rings
+        input_key = content_key(func_param['station_id'], grid_key(dwd_ds=ds_window), field_radius,
+                                first.values, df['FF_10'].values, df.index.values)
+
+        result = {}
+        for base, _ in {self._field_bases[value[-1]][0]: None for value in self.metrics_build_plan.values()}.items():
+            field_key = content_key(input_key, base.__name__)
 
-        self._ds_station_grid = station_to_dwd_grid(df=func_param['df'],
-                                                    lat_station=func_param['latitude'],
-                                                    lon_station=func_param['longitude'],
-                                                    dwd_ds=func_param['ds'], radius=kwargs['radius_end'])
+            # per cell sum and count over time, chunks of a month add up to the same field as the whole month
+            field = self.metric_cache.get(key=field_key)
+            if field is None:
+                if station_grid is None:
+                    station_grid = station_to_dwd_grid(df=df,
+                                                       lat_station=func_param['latitude'],
+                                                       lon_station=func_param['longitude'],
+                                                       dwd_ds=ds_window, radius=field_radius)
+
+                deviation = base(first, station_grid['FF'], 'X', 'Y')
+                deviation = deviation[list(deviation.data_vars)[0]]
+                deviation = deviation.where(np.isfinite(deviation))
+
+                field = xr.Dataset(dict(sum=deviation.sum(dim='time'), count=deviation.count(dim='time')))
+                self.metric_cache.put(key=field_key, field=field)
+
+            result.update({f'{base.__name__}_sum': field['sum'].transpose('Y', 'X').values[np.newaxis],
+                           f'{base.__name__}_count': field['count'].transpose('Y', 'X').values[np.newaxis]})
+
+        return result
+
+    def after_each_station(self, result, parameters):
+        if not result:
+            return None
+
+        rings = self.build_rings(kwargs=parameters)
+        x, y = self._station_xy
 
         for key, value in self.metrics_build_plan.items():
-            tmp_metric_result = value[0](func_param['ds']['FF'], self._ds_station_grid['FF'], 'X', 'Y')
-            self._total_area_metrics.update({key: tmp_metric_result})
+            base, cell_funcs = self._field_bases[value[-1]]
+
+            sums = np.sum(result[f'{base.__name__}_sum'], axis=0)
+            counts = np.sum(result[f'{base.__name__}_count'], axis=0)
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                field = sums / counts
+
+            for func in cell_funcs:
+                field = func(field)
 
-        result = {key: [None for _ in range(len(rings))] for key in list(self.metrics_build_plan)}
+            self._total_area_metrics.update({key: xr.Dataset({key: (['Y', 'X'], field)},
+                                                             coords=dict(Y=self._ds_station_grid['Y'].values,
+                                                                         X=self._ds_station_grid['X'].values))})
+
+        # per ring the cell values of each metric, rings hold different numbers of cells
+        ring_values = {key: [None for _ in range(len(rings))] for key in list(self.metrics_build_plan)}
         if self.thread_count == 1:
             for i, ring in enumerate(rings):
-                tmp_result = self.perform_ring_analysis(ring,
-                                                        list(self.metrics_build_plan),
-                                                        func_param['longitude'],
-                                                        func_param['latitude'])
-                for key in result.keys():
-                    result[key][i] = tmp_result[key]
+                tmp_result = self.perform_ring_analysis(ring, list(self.metrics_build_plan), x, y)
+                for key in ring_values.keys():
+                    ring_values[key][i] = tmp_result[key]
 
         elif self.thread_count > 1:
-            with ThreadPoolExecutor(max_workers=8) as executor:
+            with ThreadPoolExecutor(max_workers=self.thread_count) as executor:
                 tasks = {executor.submit(self.perform_ring_analysis,
                                          ring,
                                          list(self.metrics_build_plan),
-                                         func_param['longitude'],
-                                         func_param['latitude']): ring for ring in rings
+                                         x, y): i for i, ring in enumerate(rings)
                          }
 
                 for task in as_completed(tasks):
-                    for key in result.keys():
-                        result[key][task] = task.result()[key]
+                    for key in ring_values.keys():
+                        ring_values[key][tasks[task]] = task.result()[key]
 
         else:
-            raise ''
+            raise ValueError(f'thread_count must be at least 1 but got {self.thread_count}')
+
+        df_result = pd.DataFrame(dict(radius_inner=rings[:, 0], radius=rings[:, 1]))
+        for key, value in self.metrics_build_plan.items():
+            # the plan lists its functions outermost first: [ring aggregation or None, ..., field function]
+            ring_funcs = [func for func in value[-2::-1] if func is not None]
+
+            metric_result = []
+            for cells in ring_values[key]:
+                if len(cells) == 0:
+                    metric_result.append(np.nan)
+                    continue
+
+                for func in ring_funcs:
+                    cells = func(cells)
+                metric_result.append(float(cells))
+
+            df_result[key] = metric_result
+
+        return df_result
+
+    def run_analysis(self, **kwargs) -> int:
+        return super().run_analysis(func=self.spatial_analysis, after_each_station=self.after_each_station, **kwargs)
+
+    def run_sharded(self, **kwargs) -> int:
+        return super().run_sharded(func=self.spatial_analysis, after_each_station=self.after_each_station, **kwargs)
+
 
-        for key in result.keys():
-            result[key] = np.asarray(result[key]).flatten()
+class DirectionalAnalysis(SpatialAnalysis):
+    station_columns = ['FF_10', 'DD_10']
+    _polar_index: dict = None
 
-        result.update({'index': rings[:, 1]})
+    # spatial shared arrays plus the int64 labels, per metric the deviation list, its array, the transposed
+    # values and the valid values of grouped_sum
+    base_arrays = 7
+    arrays_per_metric = 4
+
+    def __init__(self, parameters: dict) -> None:
+        super(DirectionalAnalysis, self).__init__(parameters=parameters)
+
+        self._polar_index = {}
+
+    def prepare_metrics(self, metrics: list) -> None:
+        super(DirectionalAnalysis, self).prepare_metrics(metrics=metrics)
+
+        # a group pools all its hours and cells, so only metrics over the pooled deviations are defined
+        for key, value in self.metrics_build_plan.items():
+            if value[0] is not None:
+                raise ValueError(f'DirectionalAnalysis does not support {key}, use one of MAE, MAPE, MSE, RMSE')
+
+    def finalize_funcs(self, key: str) -> list:
+        # plan of a plain metric: [None, (np.sqrt,) np.nanmean, deviation], the grouped mean replaces np.nanmean
+        return [func for func in self.metrics_build_plan[key][-2:0:-1] if func is not np.nanmean]
+
+    def get_polar_index(self, dwd_ds, station_id: int, x, y, radius_edges, sector_count: int) -> np.ndarray:
+        key = (station_id, grid_key(dwd_ds=dwd_ds), tuple(radius_edges), sector_count)
+
+        if key not in self._polar_index:
+            distances, bearings = calc_polar_coordinates(dwd_ds=dwd_ds, x=x, y=y)
+
+            self._polar_index[key] = calc_polar_labels(distances=distances, bearings=bearings,
+                                                       radius_edges=radius_edges, sector_count=sector_count)
+
+        return self._polar_index[key]
+
+    def directional_analysis(self, func_param: dict, kwargs: dict) -> dict:
+        radius_edges = np.arange(kwargs['radius_start'], kwargs['radius_end'], kwargs['radius_step'])
+        sector_count = kwargs.get('sector_count', 8)
+        polar_count = sector_count * (len(radius_edges) - 1)
+
+        ds_window, x, y = self.crop_to_station(func_param=func_param, radius=kwargs['radius_end'])
+
+        polar_labels = self.get_polar_index(dwd_ds=ds_window, station_id=func_param['station_id'], x=x, y=y,
+                                            radius_edges=radius_edges, sector_count=sector_count)
+
+        first, df = self.align_chunk(func_param=func_param, ds_window=ds_window)
+        station_grid = station_to_dwd_grid(df=df, lat_station=func_param['latitude'],
+                                           lon_station=func_param['longitude'],
+                                           dwd_ds=ds_window, radius=kwargs['radius_end'])
+
+        # hours without a valid wind direction go into the extra last wind sector, so summing over
+        # all wind sectors still gives the unconditioned result
+        wind_sectors = calc_sector(bearings=df['DD_10'].values, sector_count=sector_count)
+        wind_sectors[wind_sectors < 0] = sector_count
+
+        labels = wind_sectors[:, np.newaxis, np.newaxis] * polar_count + polar_labels[np.newaxis]
+        labels = np.where(polar_labels[np.newaxis] < 0, -1, labels)
+
+        result = {}
+        for key, value in self.metrics_build_plan.items():
+            deviation = value[-1](first, station_grid['FF'], 'X', 'Y')
+            deviation = deviation[list(deviation.data_vars)[0]].transpose('time', 'Y', 'X').values
+
+            sums, counts = grouped_sum(values=deviation, labels=labels,
+                                       group_count=(sector_count + 1) * polar_count)
+
+            result.update({f'{key}_sum': sums[np.newaxis], f'{key}_count': counts[np.newaxis]})
 
         return result
 
     def after_each_station(self, result, parameters):
-        for key, value in self.metrics_build_plan.items():
-            metric_result = result[key]
-            metric_result = np.asarray(metric_result)
-            metric_result = metric_result.flatten()
+        if not result:
+            return None
+
+        radius_edges = np.arange(parameters['radius_start'], parameters['radius_end'], parameters['radius_step'])
+        sector_count = parameters.get('sector_count', 8)
+        ring_count = len(radius_edges) - 1
+        shape = (sector_count + 1, sector_count, ring_count)
+
+        wind_sector, sector, ring = np.meshgrid(np.arange(-1, sector_count), np.arange(sector_count),
+                                                np.arange(ring_count), indexing='ij')
+
+        # wind_sector -1 holds the unconditioned metric over all hours
+        df_result = pd.DataFrame(dict(wind_sector=wind_sector.ravel(),
+                                      sector=sector.ravel(),
+                                      radius=radius_edges[1:][ring.ravel()]))
+
+        for key in self.metrics_build_plan:
+            sums = np.sum(result[f'{key}_sum'], axis=0).reshape(shape)
+            counts = np.sum(result[f'{key}_count'], axis=0).reshape(shape)
+
+            sums = np.concatenate((sums.sum(axis=0, keepdims=True), sums[:-1]))
+            counts = np.concatenate((counts.sum(axis=0, keepdims=True), counts[:-1]))
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                metric_result = sums / counts
 
-            for func in value[1:]:
+            for func in self.finalize_funcs(key=key):
                 metric_result = func(metric_result)
 
-            result[key] = metric_result
+            df_result[key] = metric_result.ravel()
 
-        df_result = pd.DataFrame.from_dict(result)
-        df_result.index = result['index']
+        return df_result
 
-        df_result.to_feather(path=parameters['result_path'])
+    def run_analysis(self, **kwargs) -> int:
+        return AnalysisBuilder.run_analysis(self, func=self.directional_analysis,
+                                            after_each_station=self.after_each_station, **kwargs)
 
-    def run_analysis(self, **kwargs):
-        super().run_analysis(func=self.spatial_analysis, after_each_station=self.after_each_station, kwargs=kwargs)
\ No newline at end of file
+    def run_sharded(self, **kwargs) -> int:
+        return AnalysisBuilder.run_sharded(self, func=self.directional_analysis,
+                                           after_each_station=self.after_each_station, **kwargs)
@@ -0,0 +1,147 @@
+import os
+import hashlib
+import logging
+
+from threading import Lock
+from collections import OrderedDict
+
+import numpy as np
+import xarray as xr
+
+from DataAnalysis.utilities import XarrayToNetCDF
+
+
+def content_key(*parts) -> str:
+    sha = hashlib.sha1()
+
+    for part in parts:
+        if isinstance(part, (np.ndarray, xr.DataArray)):
+            part = np.ascontiguousarray(part)
+            sha.update(str((part.dtype, part.shape)).encode())
+            sha.update(part.tobytes())
+        else:
+            sha.update(repr(part).encode())
+
+        sha.update(b'|')
+
+    return sha.hexdigest()
+
+
+class MetricFieldCache(object):
+    # Two level LRU cache of time-mean metric fields. The memory level holds up to max_memory_bytes, the disk level
+    # (optional, shared between processes) up to max_disk_bytes of NetCDF files in path. The disk level is only
+    # scanned when the running total of this process exceeds max_disk_bytes, it is then evicted down to
+    # disk_low_water of it.
+    disk_low_water = 0.9
+
+    def __init__(self, path: str = None, max_memory_bytes: int = 512 * 2 ** 20, max_disk_bytes: int = 8 * 2 ** 30):
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._disk_bytes = 0
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.nc')
+
+    def _remember(self, key: str, field: xr.Dataset) -> None:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+
+            self._memory[key] = field
+            self._memory_bytes += field.nbytes
+
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.nbytes
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        if self.path is not None and os.path.isfile(self._file(key)):
+            try:
+                field = xr.load_dataset(self._file(key))
+                # the access time of a disk entry is its mtime, used for the LRU eviction on disk
+                os.utime(self._file(key))
+
+            except (OSError, ValueError) as e:
+                logging.warning(f'MetricFieldCache.get() -> unreadable entry {key}: {e}')
+                return None
+
+            self._remember(key=key, field=field)
+            with self._lock:
+                self.hits += 1
+            return field
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, field: xr.Dataset) -> None:
+        self._remember(key=key, field=field)
+
+        if self.path is None or os.path.isfile(self._file(key)):
+            return
+
+        # write under a temporary name first, other processes must never load a partially written entry
+        tmp_path = self._file(key) + f'.{os.getpid()}.tmp'
+        XarrayToNetCDF(path=tmp_path, xarray=field)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, self._file(key))
+
+        with self._lock:
+            self._disk_bytes += size
+            evict = self._disk_bytes > self.max_disk_bytes
+
+        if evict:
+            self._evict_disk()
+
+    def _disk_entries(self) -> list:
+        entries = []
+        for file in os.listdir(self.path):
+            if file.endswith('.nc'):
+                try:
+                    stat = os.stat(os.path.join(self.path, file))
+                    entries.append((stat.st_mtime, stat.st_size, file))
+
+                except FileNotFoundError:
+                    continue
+
+        return entries
+
+    def _evict_disk(self) -> None:
+        # the scan also picks up the entries written by other processes since the last one
+        entries = self._disk_entries()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total <= self.max_disk_bytes * self.disk_low_water:
+                break
+
+            try:
+                os.remove(os.path.join(self.path, file))
+                total -= size
+
+            except FileNotFoundError:
+                # already evicted by another worker
+                total -= size
+
+        with self._lock:
+            self._disk_bytes = total
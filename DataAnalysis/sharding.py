@@ -0,0 +1,207 @@
+import os
+import time
+import socket
+import logging
+import sqlite3 as sql
+
+from threading import Thread, Event
+from contextlib import closing
+
+import pandas as pd
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def default_worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class WorkQueue(object):
+    # SQLite backed queue of (station table, TRY file) units in a directory shared by all workers.
+    # A claimed unit is leased to its worker, if the lease runs out (worker died) it can be claimed again.
+
+    def __init__(self, shard_dir: str, lease_seconds: float = 3600, max_attempts: int = 3) -> None:
+        self.shard_dir = shard_dir
+        self.result_dir = os.path.join(shard_dir, 'results')
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        os.makedirs(self.result_dir, exist_ok=True)
+
+        self.path = os.path.join(shard_dir, 'queue.db')
+        with closing(self.connect()) as con:
+            con.execute('''
+                CREATE TABLE IF NOT EXISTS units (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    station_table VARCHAR(100) NOT NULL,
+                    try_file VARCHAR(100) NOT NULL,
+                    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+                    worker VARCHAR(100),
+                    lease_until FLOAT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result_path VARCHAR(255),
+                    error TEXT,
+                    UNIQUE (station_table, try_file))
+            ''')
+
+    def connect(self) -> sql.Connection:
+        con = sql.connect(database=self.path, timeout=60, isolation_level=None)
+        con.execute('PRAGMA busy_timeout = 60000')
+        return con
+
+    def populate(self, station_tables: list, try_files: list) -> int:
+        units = [(table, try_file) for try_file in try_files for table in station_tables]
+
+        con = self.connect()
+        try:
+            con.execute('BEGIN IMMEDIATE')
+            before = con.execute('SELECT COUNT(*) FROM units').fetchone()[0]
+            con.executemany('INSERT OR IGNORE INTO units (station_table, try_file) VALUES (?, ?)', units)
+            after = con.execute('SELECT COUNT(*) FROM units').fetchone()[0]
+            con.execute('COMMIT')
+
+        except sql.Error:
+            con.execute('ROLLBACK')
+            raise
+
+        finally:
+            con.close()
+
+        return after - before
+
+    def claim(self, worker: str) -> (int, str, str):
+        now = time.time()
+
+        con = self.connect()
+        try:
+            # BEGIN IMMEDIATE takes the write lock, so no two workers can claim the same unit
+            con.execute('BEGIN IMMEDIATE')
+
+            # a unit whose workers died max_attempts times is given up instead of being claimed again
+            con.execute('''
+                UPDATE units SET status = ?, lease_until = NULL, error = ?
+                WHERE status = ? AND lease_until < ? AND attempts >= ?
+            ''', (FAILED, 'lease expired', RUNNING, now, self.max_attempts))
+
+            row = con.execute('''
+                SELECT id, station_table, try_file FROM units
+                WHERE status = ? OR (status = ? AND lease_until < ? AND attempts < ?)
+                ORDER BY try_file, id
+                LIMIT 1
+            ''', (PENDING, RUNNING, now, self.max_attempts)).fetchone()
+
+            if row is not None:
+                con.execute('''
+                    UPDATE units SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1
+                    WHERE id = ?
+                ''', (RUNNING, worker, now + self.lease_seconds, row[0]))
+
+            con.execute('COMMIT')
+
+        except sql.Error:
+            con.execute('ROLLBACK')
+            raise
+
+        finally:
+            con.close()
+
+        return row
+
+    def renew(self, unit_id: int, worker: str) -> bool:
+        with closing(self.connect()) as con:
+            cursor = con.execute('UPDATE units SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?',
+                                 (time.time() + self.lease_seconds, unit_id, worker, RUNNING))
+            return cursor.rowcount == 1
+
+    def complete(self, unit_id: int, worker: str, result_path: str = None) -> bool:
+        # result_path None marks a unit finished without a result, e.g. a station without rows in the month
+        with closing(self.connect()) as con:
+            cursor = con.execute('''
+                UPDATE units SET status = ?, result_path = ?, lease_until = NULL, error = NULL
+                WHERE id = ? AND worker = ? AND status = ?
+            ''', (DONE, result_path, unit_id, worker, RUNNING))
+            return cursor.rowcount == 1
+
+    def fail(self, unit_id: int, worker: str, error: str) -> None:
+        with closing(self.connect()) as con:
+            con.execute('''
+                UPDATE units SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_until = NULL, error = ?
+                WHERE id = ? AND worker = ? AND status = ?
+            ''', (self.max_attempts, FAILED, PENDING, error, unit_id, worker, RUNNING))
+
+    def result_path(self, station_table: str, try_file: str) -> str:
+        return os.path.join(self.result_dir, f'{station_table}__{os.path.splitext(try_file)[0]}.feather')
+
+    def status(self) -> dict:
+        with closing(self.connect()) as con:
+            rows = con.execute('SELECT status, COUNT(*) FROM units GROUP BY status').fetchall()
+
+        return {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0} | dict(rows)
+
+    def merge(self, result_path: str, allow_partial: bool = False) -> pd.DataFrame:
+        status = self.status()
+        if not allow_partial and status[DONE] != sum(status.values()):
+            raise RuntimeError(f'Work queue {self.path} is not finished -> {status}')
+
+        with closing(self.connect()) as con:
+            units = con.execute('SELECT station_table, try_file, result_path FROM units WHERE status = ? ORDER BY id',
+                                (DONE,)).fetchall()
+
+        results = []
+        for station_table, try_file, unit_path in units:
+            if unit_path is None:
+                continue
+
+            df = pd.read_feather(path=unit_path)
+            df.insert(0, 'try_file', try_file)
+            df.insert(0, 'station_table', station_table)
+            results.append(df)
+
+        df_result = pd.concat(objs=results, ignore_index=True) if results else pd.DataFrame()
+        df_result.to_feather(path=result_path)
+
+        return df_result
+
+
+def run_worker(queue: WorkQueue, run_unit, worker: str = None) -> int:
+    # run_unit(station_table, try_file, result_path) performs one unit, writes its result to result_path and
+    # returns whether there was a result
+    worker = worker if worker is not None else default_worker_id()
+    done_count = 0
+
+    while True:
+        unit = queue.claim(worker=worker)
+        if unit is None:
+            return done_count
+
+        unit_id, station_table, try_file = unit
+        result_path = queue.result_path(station_table=station_table, try_file=try_file)
+
+        stop = Event()
+        heartbeat = Thread(target=_heartbeat, args=(queue, unit_id, worker, stop), daemon=True)
+        heartbeat.start()
+
+        try:
+            written = run_unit(station_table, try_file, result_path)
+
+            if queue.complete(unit_id=unit_id, worker=worker, result_path=result_path if written else None):
+                done_count += 1
+            else:
+                logging.warning(f'run_worker() -> lease of {station_table}/{try_file} lost by {worker}')
+
+        except Exception as e:
+            logging.error(f'run_worker() -> {station_table}/{try_file}: {e}')
+            queue.fail(unit_id=unit_id, worker=worker, error=str(e))
+
+        finally:
+            stop.set()
+            heartbeat.join()
+
+
+def _heartbeat(queue: WorkQueue, unit_id: int, worker: str, stop: Event) -> None:
+    while not stop.wait(timeout=queue.lease_seconds / 3):
+        if not queue.renew(unit_id=unit_id, worker=worker):
+            return
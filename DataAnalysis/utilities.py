@@ -63,13 +63,12 @@ def find_nearest(array, value):
     array = np.asarray(array)
     idx = (np.abs(array - value)).argmin()
 
-    y = int(idx / np.shape(array)[0])
-    x = idx % np.shape(array)[1]
+    y, x = np.unravel_index(idx, np.shape(array))
     return x, y
 
 
 def calc_mask(dwd_ds, x, y, radius):
-    shape = (dwd_ds.dims.get('Y'), dwd_ds.dims.get('X'))
+    shape = (dwd_ds.sizes.get('Y'), dwd_ds.sizes.get('X'))
     distances = np.zeros(shape=shape)
 
     for i, y_ in enumerate(dwd_ds['Y'].values):
@@ -93,9 +92,151 @@ def to_coordinate(lat_station, lon_station, dwd_ds):
     return dwd_ds['X'][lon_x].values, dwd_ds['Y'][lat_y].values
 
 
+def grid_key(dwd_ds) -> tuple:
+    return (dwd_ds.sizes.get('Y'), dwd_ds.sizes.get('X'),
+            float(dwd_ds['Y'].values[0]), float(dwd_ds['X'].values[0]))
+
+
+def calc_window(dwd_ds, x, y, radius) -> dict:
+    # smallest X/Y index window containing every cell within radius of (x, y)
+    x_idx = np.flatnonzero(np.abs(dwd_ds['X'].values - x) < radius)
+    y_idx = np.flatnonzero(np.abs(dwd_ds['Y'].values - y) < radius)
+
+    return dict(X=slice(int(x_idx[0]), int(x_idx[-1]) + 1), Y=slice(int(y_idx[0]), int(y_idx[-1]) + 1))
+
+
+def read_tile(da: xr.DataArray, time, y: slice, x: slice) -> np.ndarray:
+    return da.isel(time=time, Y=y, X=x).transpose('time', 'Y', 'X').values
+
+
+def extract_station_windows(store_path: str, stations: dict, radius, time_start=None, time_end=None) -> dict:
+    # stations: {station_id: (latitude, longitude)}, store_path: the rechunked TRY store
+    result = {}
+
+    with xr.open_dataset(store_path) as store:
+        windows = {}
+        for station_id, (lat, lon) in stations.items():
+            x, y = to_coordinate(lat_station=lat, lon_station=lon, dwd_ds=store)
+            windows[station_id] = calc_window(dwd_ds=store, x=x, y=y, radius=radius)
+
+        if not windows:
+            return result
+
+        time = store.indexes['time'].slice_indexer(time_start, time_end)
+        chunks = store['FF'].encoding.get('chunksizes')
+        tile_y, tile_x = (chunks[1], chunks[2]) if chunks else (16, 16)
+
+        # every store tile touched by a window is read once, close stations share their tiles and nothing
+        # between distant stations is read
+        tiles = {}
+        for station_id, window in windows.items():
+            for ty in range(window['Y'].start // tile_y, (window['Y'].stop - 1) // tile_y + 1):
+                for tx in range(window['X'].start // tile_x, (window['X'].stop - 1) // tile_x + 1):
+                    tiles.setdefault((ty, tx), []).append(station_id)
+
+        ff = {}
+        for station_id, window in windows.items():
+            ds = store.isel(window).isel(time=time)
+            result[station_id] = ds.drop_vars('FF').load()
+            ff[station_id] = np.empty(shape=(ds.sizes.get('time'), ds.sizes.get('Y'), ds.sizes.get('X')),
+                                      dtype=ds['FF'].dtype)
+
+        for (ty, tx), station_ids in sorted(tiles.items()):
+            y = slice(ty * tile_y, min((ty + 1) * tile_y, store.sizes.get('Y')))
+            x = slice(tx * tile_x, min((tx + 1) * tile_x, store.sizes.get('X')))
+            tile = read_tile(da=store['FF'], time=time, y=y, x=x)
+
+            for station_id in station_ids:
+                window = windows[station_id]
+                y_start, y_stop = max(y.start, window['Y'].start), min(y.stop, window['Y'].stop)
+                x_start, x_stop = max(x.start, window['X'].start), min(x.stop, window['X'].stop)
+
+                ff[station_id][:, y_start - window['Y'].start:y_stop - window['Y'].start,
+                               x_start - window['X'].start:x_stop - window['X'].start] = \
+                    tile[:, y_start - y.start:y_stop - y.start, x_start - x.start:x_stop - x.start]
+
+        for station_id in windows:
+            result[station_id]['FF'] = xr.DataArray(data=ff[station_id], dims=['time', 'Y', 'X'],
+                                                    attrs=store['FF'].attrs)
+
+    return result
+
+
+def calc_polar_coordinates(dwd_ds, x, y):
+    dx = dwd_ds['X'].values[np.newaxis, :] - x
+    dy = dwd_ds['Y'].values[:, np.newaxis] - y
+
+    distances = np.hypot(dx, dy)
+    # bearing clockwise from grid north, 0 <= bearing < 360
+    bearings = np.degrees(np.arctan2(dx, dy)) % 360
+
+    return distances, bearings
+
+
+def calc_sector(bearings, sector_count: int) -> np.ndarray:
+    bearings = np.asarray(bearings, dtype=float)
+    width = 360 / sector_count
+
+    # sector 0 is centred on north
+    sectors = ((bearings + width / 2) % 360) // width
+    sectors = np.where(np.isnan(sectors), -1, sectors)
+
+    return sectors.astype(int)
+
+
+def calc_ring(distances, radius_edges) -> np.ndarray:
+    radius_edges = np.asarray(radius_edges)
+
+    rings = np.searchsorted(radius_edges, distances, side='right') - 1
+    rings[(rings < 0) | (rings >= len(radius_edges) - 1)] = -1
+
+    return rings
+
+
+def calc_polar_labels(distances, bearings, radius_edges, sector_count: int) -> np.ndarray:
+    ring_count = len(radius_edges) - 1
+
+    rings = calc_ring(distances=distances, radius_edges=radius_edges)
+    sectors = calc_sector(bearings=bearings, sector_count=sector_count)
+
+    labels = sectors * ring_count + rings
+    labels[(rings < 0) | (sectors < 0)] = -1
+
+    return labels
+
+
+def grouped_sum(values, labels, group_count: int) -> (np.ndarray, np.ndarray):
+    values = np.asarray(values).ravel()
+    labels = np.asarray(labels).ravel()
+
+    valid = (labels >= 0) & np.isfinite(values)
+
+    sums = np.bincount(labels[valid], weights=values[valid], minlength=group_count)
+    counts = np.bincount(labels[valid], minlength=group_count)
+
+    return sums, counts
+
+
+def station_to_hourly(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.replace(to_replace=-999.0, value=np.nan)
+
+    # wind direction is averaged as unit vector, a plain mean of 350° and 10° would be 180°
+    if 'DD_10' in df.columns:
+        direction = np.deg2rad(df.pop('DD_10'))
+        df['DD_10_U'] = np.sin(direction)
+        df['DD_10_V'] = np.cos(direction)
+
+    df = df.groupby(pd.Grouper(freq='h')).mean()
+
+    if 'DD_10_U' in df.columns:
+        df['DD_10'] = np.degrees(np.arctan2(df.pop('DD_10_U'), df.pop('DD_10_V'))) % 360
+
+    return df
+
+
 def station_to_dwd_grid(df: pd.DataFrame, lat_station, lon_station, dwd_ds, radius):
     station_grid = []
-    shape = (dwd_ds.dims.get('Y'), dwd_ds.dims.get('X'))
+    shape = (dwd_ds.sizes.get('Y'), dwd_ds.sizes.get('X'))
 
     for ff in df['FF_10'].values:
         station_grid.append(np.full(shape=shape, fill_value=ff))
@@ -147,9 +288,8 @@ def calc_root_mean_square_deviation(first: xr.DataArray, second: xr.DataArray, x
 
 
 def pre_calc(first: xr.DataArray, second: xr.DataArray, x_key: str, y_key: str):
-    if first.sizes.get(x_key) != second.sizes.get(y_key):
-        print(f'{np.shape(first)} != {np.shape(second)}')
-        raise f'{np.shape(first)} != {np.shape(second)}'
+    if first.sizes.get(x_key) != second.sizes.get(x_key) or first.sizes.get(y_key) != second.sizes.get(y_key):
+        raise ValueError(f'{np.shape(first)} != {np.shape(second)}')
 
     if first.sizes.get('time') > second.sizes.get('time'):
         first = first.sel(time=second['time'])
@@ -8,11 +8,16 @@ import zipfile
 import gzip
 import sys
 import os
-from threading import Thread
+import logging
+from collections import deque
+from datetime import timezone
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from DataAnalysis.utilities import *
 
+# columns of a station table which are no measurements
+STATION_META_COLUMNS = ['STATIONS_ID', 'QN', 'time', 'timestamp']
+
 
 def getStationDescription(url: str, path: str) -> bool:
     sys.stdout.write(f'\r Download {url} ...')
@@ -126,52 +131,127 @@ def getAllDatasource(url: str, station_id=None) -> list[str]:
         return [a['href'] for a in soup.find_all('a') if '.zip' in a['href'] and str(station_id).zfill(5) in a['href']]
 
 
-def downloadZipAndUnzip(file_url: str) -> pd.DataFrame:
-    sys.stdout.write(f'\rDownload and unzip file: {file_url} ...')
-    sys.stdout.flush()
-
+def downloadZip(file_url: str) -> bytes:
     response = requests.get(url=file_url, stream=True)
+    response.raise_for_status()
+
+    return response.content
+
+
+def prepareStationChunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    chunk.columns = chunk.columns.str.strip()
+    chunk = chunk.drop(columns=[column for column in ['eor'] if column in chunk.columns])
+
+    time = pd.to_datetime(chunk.pop('MESS_DATUM').astype(str), format='%Y%m%d%H%M')
+    chunk['time'] = time
+    # MESS_DATUM is UTC, the timestamp is taken as UTC instead of the local time zone of the machine
+    chunk['timestamp'] = (time - pd.Timestamp('1970-01-01')) // pd.Timedelta(seconds=1)
+
+    values = [column for column in chunk.columns if column not in STATION_META_COLUMNS]
+    chunk[values] = chunk[values].mask(chunk[values] == -999)
+
+    return chunk
+
+
+def aggregateHourly(df: pd.DataFrame) -> pd.DataFrame:
+    # hours are labeled by their start, the same as the TRY time steps and station_to_hourly
+    hours = df['time'].dt.floor('h')
+    grouped = df.groupby(hours)
+
+    result = pd.DataFrame({'STATIONS_ID': grouped['STATIONS_ID'].first()})
+    for column in [column for column in df.columns if column not in STATION_META_COLUMNS]:
+        if column == 'DD_10':
+            direction = np.deg2rad(df['DD_10'])
+            u = np.sin(direction).groupby(hours).mean()
+            v = np.cos(direction).groupby(hours).mean()
+            result['DD_10'] = np.degrees(np.arctan2(u, v)) % 360
+            result['DD_10_count'] = grouped['DD_10'].count()
+        else:
+            result[column] = grouped[column].mean()
+            result[f'{column}_count'] = grouped[column].count()
+            result[f'{column}_max'] = grouped[column].max()
+
+    result.index.name = 'time'
+    result = result.reset_index()
+    result['timestamp'] = (result['time'] - pd.Timestamp('1970-01-01')) // pd.Timedelta(seconds=1)
+
+    return result
 
-    zip_file = BytesIO(response.content)
-    files = zipfile.ZipFile(zip_file)
+
+def ingestStationZip(zip_content: bytes, connection: sql.Connection, table_name: str,
+                     chunk_size: int = 100000) -> int:
+    files = zipfile.ZipFile(BytesIO(zip_content))
 
     if len(files.namelist()) > 1:
-        raise
+        raise ValueError(f'Expected one file per station archive but got {files.namelist()}')
 
-    df = pd.read_csv(files.open(files.namelist()[0]), delimiter=';')
+    row_count = 0
+    carry = None
+    with files.open(files.namelist()[0]) as member:
+        for chunk in pd.read_csv(member, delimiter=';', chunksize=chunk_size):
+            chunk = prepareStationChunk(chunk=chunk)
+            chunk.to_sql(name=table_name, con=connection, if_exists='append', index=False)
+            row_count += len(chunk)
 
-    sys.stdout.write(f'\rDownload and unzip file: {file_url} Done\n')
-    sys.stdout.flush()
+            # the last hour of a chunk may continue in the next one, it is aggregated together with that chunk
+            if carry is not None:
+                chunk = pd.concat(objs=[carry, chunk], ignore_index=True)
+
+            last_hour = chunk['time'].iloc[-1].floor('h')
+            carry = chunk.loc[chunk['time'] >= last_hour]
+            complete = chunk.loc[chunk['time'] < last_hour]
+
+            if not complete.empty:
+                aggregateHourly(df=complete).to_sql(name=f'{table_name}_hourly', con=connection,
+                                                    if_exists='append', index=False)
 
-    return df
+    if carry is not None and not carry.empty:
+        aggregateHourly(df=carry).to_sql(name=f'{table_name}_hourly', con=connection, if_exists='append',
+                                         index=False)
 
+    return row_count
+
+
+def ingestStationFile(file: str, zip_content: bytes, connection: sql.Connection, table_name: str) -> int:
+    sys.stdout.write(f'\rIngest file: {file} ...')
+    sys.stdout.flush()
 
-def thread_helper_station(file_url: str, result: list, thread_idx: int):
-    station_histo = downloadZipAndUnzip(file_url=file_url)
+    row_count = ingestStationZip(zip_content=zip_content, connection=connection, table_name=table_name)
 
-    station_histo['time'] = station_histo['MESS_DATUM'].apply(lambda date: dateToDatetime64(date_DWD_format=str(date)))
-    station_histo['timestamp'] = station_histo['MESS_DATUM'].apply(lambda date: dateToTimestamp(date_DWD_format=str(date)))
-    station_histo.drop(columns='MESS_DATUM', inplace=True)
+    sys.stdout.write(f'\rIngest file: {file} Done\n')
+    sys.stdout.flush()
 
-    result[thread_idx] = station_histo
+    return row_count
 
 
-def getStationDataset(url, station_id: int) -> pd.DataFrame:
+def ingestStationDataset(url, station_id: int, connection: sql.Connection, table_name: str,
+                         prefetch: int = 4) -> int:
     files = getAllDatasource(url=url, station_id=station_id)
 
-    result = np.empty(shape=len(files), dtype=pd.DataFrame)
-    threads = []
-    for idx, file in enumerate(files):
-        thread = Thread(target=thread_helper_station, args=(url + file, result, idx))
-        threads.append(thread)
-        thread.start()
+    row_count = 0
+    # archives are downloaded in parallel, but ingested one after the other into the shared connection;
+    # at most prefetch archives are downloaded ahead, so only these are held in memory
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        pending = deque()
+        for file in files:
+            pending.append((file, executor.submit(downloadZip, url + file)))
+
+            if len(pending) >= prefetch:
+                file, task = pending.popleft()
+                row_count += ingestStationFile(file=file, zip_content=task.result(), connection=connection,
+                                               table_name=table_name)
 
-    for thread in threads:
-        thread.join()
+        while pending:
+            file, task = pending.popleft()
+            row_count += ingestStationFile(file=file, zip_content=task.result(), connection=connection,
+                                           table_name=table_name)
 
-    df_histo = pd.concat(objs=result, ignore_index=True)
+    # the analysis reads one month per unit by its timestamp
+    for table in set(getAllTables(connection=connection)) & {table_name, f'{table_name}_hourly'}:
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_timestamp ON {table} (timestamp)')
+    connection.commit()
 
-    return df_histo
+    return row_count
 
 
 def stationsToDB(connection: sql.Connection, url, download_param: str = None, value=None,
@@ -196,13 +276,19 @@ def stationsToDB(connection: sql.Connection, url, download_param: str = None, va
         table_name = f'Station{str(station_id).zfill(5)}_{cleanString(name)}_{cleanString(bundesland)}'
 
         if if_exists == 'continue' and table_name not in all_existing_tables:
-            station_histo: pd.DataFrame = getStationDataset(url=url, station_id=station_id)
-
             sys.stdout.write(
-                f'\rWriting Station {station_id}-{name}-{bundesland} into {table_name} -> [{download_count} / {len(station_ids)}] ...')
+                f'\rWriting Station {station_id}-{name}-{bundesland} into {table_name} -> [{download_count} / {len(station_ids)}] ...\n')
             sys.stdout.flush()
 
-            station_histo.to_sql(name=table_name, con=connection, if_exists='fail', index=False)
+            try:
+                ingestStationDataset(url=url, station_id=station_id, connection=connection, table_name=table_name)
+
+            except Exception:
+                # a partly ingested station would be skipped by the next run, so it is removed again
+                connection.execute(f'DROP TABLE IF EXISTS {table_name}')
+                connection.execute(f'DROP TABLE IF EXISTS {table_name}_hourly')
+                connection.commit()
+                raise
 
             sys.stdout.write(
                 f'\rWriting Station {station_id}-{name}-{bundesland} into {table_name} -> [{download_count} / {len(station_ids)}] Done\n\n')
@@ -213,8 +299,9 @@ def stationsToDB(connection: sql.Connection, url, download_param: str = None, va
 
 def databaseToXarray(tables: list, start_date, end_date, connection: sql.Connection):
     if isinstance(start_date, str) and isinstance(end_date, str):
-        start_date = datetime.strptime(start_date, '%d.%m.%Y %H:%M').timestamp()
-        end_date = datetime.strptime(end_date, '%d.%m.%Y %H:%M').timestamp()
+        # the station timestamps are UTC, the bounds are read as UTC as well
+        start_date = datetime.strptime(start_date, '%d.%m.%Y %H:%M').replace(tzinfo=timezone.utc).timestamp()
+        end_date = datetime.strptime(end_date, '%d.%m.%Y %H:%M').replace(tzinfo=timezone.utc).timestamp()
 
     sql_query = f'''
         SELECT beschreibung.Stations_id, beschreibung.Stationshoehe, beschreibung.geoBreite, beschreibung.geoLaenge,
@@ -289,3 +376,105 @@ def downloadAllNCs(url: str, path: str, start_year, end_year):
         for task in as_completed(tasks):
             if task.result() <= 0:
                 print(f'Failed to download {tasks[task]}')
+
+
+def _toHours(times) -> np.ndarray:
+    return ((np.asarray(times, dtype='datetime64[h]') - np.datetime64('1970-01-01T00', 'h')) // np.timedelta64(1, 'h')).astype(np.int64)
+
+
+def _createStore(store_path: str, ds: xr.Dataset, chunk_size: int, time_chunk: int) -> None:
+    import netCDF4
+
+    with netCDF4.Dataset(store_path, mode='w', format='NETCDF4') as store:
+        store.createDimension('time', None)
+        store.createDimension('Y', ds.sizes.get('Y'))
+        store.createDimension('X', ds.sizes.get('X'))
+
+        for name in ['X', 'Y']:
+            var = store.createVariable(name, ds[name].dtype, (name,))
+            var.setncatts(ds[name].attrs)
+            var[:] = ds[name].values
+
+        for name in ['lat', 'lon']:
+            if name in ds:
+                var = store.createVariable(name, ds[name].dtype, ('Y', 'X'), zlib=True)
+                var.setncatts(ds[name].attrs)
+                var[:] = ds[name].transpose('Y', 'X').values
+
+        time = store.createVariable('time', 'i8', ('time',), chunksizes=(time_chunk,))
+        time.units = 'hours since 1970-01-01 00:00:00'
+        time.calendar = 'proleptic_gregorian'
+
+        # small spatial tiles over long time spans: a station window over decades touches only a few chunks
+        ff = store.createVariable('FF', 'f4', ('time', 'Y', 'X'), zlib=True, fill_value=np.float32(np.nan),
+                                  chunksizes=(time_chunk, min(chunk_size, ds.sizes.get('Y')),
+                                              min(chunk_size, ds.sizes.get('X'))))
+        ff.setncatts({key: value for key, value in ds['FF'].attrs.items() if key != '_FillValue'})
+
+
+def _storeHours(store_path: str) -> np.ndarray:
+    import netCDF4
+
+    with netCDF4.Dataset(store_path, mode='r') as store:
+        return np.ma.getdata(store['time'][:]).astype(np.int64)
+
+
+def rechunkNCs(path: str, store_path: str, chunk_size: int = 16, time_chunk: int = 24 * 366) -> int:
+    import netCDF4
+
+    files = [file for file in os.listdir(path) if file.endswith('.nc')]
+    if not files:
+        return 0
+
+    file_hours = {}
+    for file in files:
+        with xr.open_dataset(path + file) as ds:
+            file_hours[file] = _toHours(ds['time'].values)
+
+    # the store is appended in time order, so files are written ordered by their first hour
+    files = sorted(files, key=lambda f: (file_hours[f][0] if len(file_hours[f]) else 0, f))
+
+    if os.path.isfile(store_path):
+        store_hours = _storeHours(store_path=store_path)
+        last_hour = store_hours[-1] if len(store_hours) else np.iinfo(np.int64).min
+
+        # a month older than the store end can not be appended, the store is rebuilt from all files instead
+        missing = [file for file in files
+                   if not np.isin(file_hours[file][file_hours[file] <= last_hour], store_hours).all()]
+        if missing:
+            logging.warning(f'rechunkNCs() -> {", ".join(missing)} older than the store end, rebuilding {store_path}')
+            os.remove(store_path)
+
+    if not os.path.isfile(store_path):
+        with xr.open_dataset(path + files[0]) as ds:
+            _createStore(store_path=store_path, ds=ds, chunk_size=chunk_size, time_chunk=time_chunk)
+
+    appended = 0
+    with netCDF4.Dataset(store_path, mode='a') as store:
+        store_hours = np.ma.getdata(store['time'][:]).astype(np.int64)
+        last_hour = store_hours[-1] if len(store_hours) else np.iinfo(np.int64).min
+
+        for file in files:
+            hours = file_hours[file]
+            new = hours > last_hour
+
+            if not new.any():
+                continue
+
+            sys.stdout.write(f'\rRechunk file: {file} ...')
+            sys.stdout.flush()
+
+            with xr.open_dataset(path + file) as ds:
+                ff = ds['FF'].transpose('time', 'Y', 'X').values[new]
+
+            start = len(store['time'])
+            store['time'][start:start + len(ff)] = hours[new]
+            store['FF'][start:start + len(ff)] = ff.astype(np.float32)
+
+            last_hour = hours[new][-1]
+            appended += 1
+
+            sys.stdout.write(f'\rRechunk file: {file} Done\n')
+            sys.stdout.flush()
+
+    return appended
@@ -1,16 +1,41 @@
 import sqlite3 as sql
 import os
-import yaml
+import sys
+import time
 import logging
 
-from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-from DataAnalysis.analysis import *
-from DataProcurement.procurement import *
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, ArgumentTypeError
 
 __DATA_PATH = './Data/'
 
+# heavy modules (pandas, xarray, requests, bs4) are only imported inside the subcommand which needs them,
+# so --help and argument errors return without loading them
+ANALYSES = ['spatial', 'directional']
+
+
+def load_config(path: str = 'config.yaml') -> dict:
+    import yaml
+
+    with open(file=path, mode='r') as config:
+        return yaml.load(stream=config, Loader=yaml.FullLoader)
+
+
+def period(value: str) -> (int, int):
+    from_to = [v.strip() for v in value.split(sep='-')]
+
+    # downloadAllNCs compares them with the YYYYMM of the TRY file names, a year alone would match no file
+    if len(from_to) != 2 or not all(len(v) == 6 and v.isdigit() and 1 <= int(v[4:]) <= 12 for v in from_to):
+        raise ArgumentTypeError(f'Expected \"<from YYYYMM>-<to YYYYMM>\" but got \"{value}\"')
+
+    if int(from_to[0]) > int(from_to[1]):
+        raise ArgumentTypeError(f'Start {from_to[0]} is after end {from_to[1]} in \"{value}\"')
+
+    return int(from_to[0]), int(from_to[1])
+
 
 def download_station_data(con: sql.Connection, config, download_param: str, value: str) -> None:
+    from DataProcurement.procurement import getStationDescription, stationDescriptionToDB, stationsToDB
+
     if not os.path.isfile(__DATA_PATH + config['dwd_station_description']):
         getStationDescription(url=config['dwd_station_url'] + config['dwd_station_description'], path=__DATA_PATH)
 
@@ -21,46 +46,239 @@ def download_station_data(con: sql.Connection, config, download_param: str, valu
 
 
 def download_grid_data(config, FROM: int, TO: int):
+    from DataProcurement.procurement import downloadAllNCs, rechunkNCs
+
     if not os.path.isdir(__DATA_PATH + 'TRY/'):
         os.mkdir(__DATA_PATH + 'TRY/')
 
     downloadAllNCs(url=config['dwd_try_url'], path=__DATA_PATH + 'TRY/', start_year=FROM, end_year=TO)
 
+    # one store chunked for long series at a station window, only new months are appended
+    rechunkNCs(path=__DATA_PATH + 'TRY/', store_path=__DATA_PATH + config['try_store_name'])
+
+
+def build_analysis(con: sql.Connection, args: dict):
+    from DataAnalysis.analysis import SpatialAnalysis, DirectionalAnalysis
+    from DataAnalysis.utilities import getAllTables
+
+    station_tables = args['stations']
+    if not station_tables:
+        station_tables = [table for table in getAllTables(connection=con)
+                          if table.startswith('Station') and not table.endswith('_hourly')]
+
+    parameters = dict(max_days=args['max_days'],
+                      connection=con,
+                      TRY_path=args['try_path'],
+                      result_path=args['result_path'],
+                      station_tables=station_tables,
+                      thread_count=args['thread_count'],
+                      raw_station_data=args['raw_station_data'],
+                      cache_path=args['cache_path'],
+                      cache_memory_bytes=args['cache_memory_mb'] * 2 ** 20,
+                      cache_disk_bytes=args['cache_disk_mb'] * 2 ** 20)
+
+    match args['analysis']:
+        case 'spatial':
+            analysis = SpatialAnalysis(parameters=parameters)
+        case 'directional':
+            analysis = DirectionalAnalysis(parameters=parameters)
+        case _:
+            raise ValueError(f'Unknown analysis {args["analysis"]}')
+
+    kwargs = dict(metrics=args['metrics'],
+                  radius_start=args['radius_start'],
+                  radius_end=args['radius_end'],
+                  radius_step=args['radius_step'],
+                  field_radius=args['field_radius'],
+                  sector_count=args['sector_count'],
+                  memory_budget=args['memory_budget_mb'] * 2 ** 20 if args['memory_budget_mb'] else None,
+                  result_path=args['result_path'])
+
+    return analysis, kwargs
+
+
+def cmd_download_stations(con: sql.Connection, config, args: dict) -> None:
+    download_station_data(con=con, config=config, download_param=config['standard_station_download_param'],
+                          value=args['value'])
+
+
+def cmd_download_try(con: sql.Connection, config, args: dict) -> None:
+    FROM, TO = args['period']
+    download_grid_data(config=config, FROM=FROM, TO=TO)
+
+
+def run_shard_worker(database: str, args: dict) -> int:
+    con = sql.connect(database=database)
+    try:
+        analysis, kwargs = build_analysis(con=con, args=args)
+        return analysis.run_sharded(shard_dir=args['shard_dir'], **kwargs)
+
+    finally:
+        con.close()
+
 
-def main() -> None:
-    config = open(file='config.yaml', mode='r')
-    config = yaml.load(stream=config, Loader=yaml.FullLoader)
+def cmd_analyze(con: sql.Connection, config, args: dict) -> int:
+    if args['shard_dir'] is None:
+        analysis, kwargs = build_analysis(con=con, args=args)
+        failed = analysis.run_analysis(**kwargs)
 
+        if failed:
+            print(f'{failed} work units failed, see the log')
+            return 1
+        return 0
+
+    from DataAnalysis.sharding import WorkQueue, FAILED
+
+    # every worker, local or on another node sharing shard_dir, claims units until the queue is empty
+    database = __DATA_PATH + config['station_wind_speed_db_name']
+    if args['workers'] == 1:
+        print(f'Finished {run_shard_worker(database=database, args=args)} work units')
+        crashed = 0
+
+    else:
+        from multiprocessing import Process
+
+        workers = [Process(target=run_shard_worker, args=(database, args)) for _ in range(args['workers'])]
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+        crashed = sum(worker.exitcode != 0 for worker in workers)
+
+    status = WorkQueue(shard_dir=args['shard_dir']).status()
+    print(f'Work units -> {status}')
+
+    if crashed or status[FAILED]:
+        return 1
+    return 0
+
+
+def cmd_merge(con: sql.Connection, config, args: dict) -> None:
+    from DataAnalysis.sharding import WorkQueue
+
+    queue = WorkQueue(shard_dir=args['shard_dir'])
+    print(f'Work units -> {queue.status()}')
+
+    df_result = queue.merge(result_path=args['result_path'], allow_partial=args['allow_partial'])
+    print(f'Merged {len(df_result)} rows into {args["result_path"]}')
+
+
+def cmd_bench(con: sql.Connection, config, args: dict) -> int:
+    start = time.perf_counter()
+    analysis, kwargs = build_analysis(con=con, args=args)
+    setup = time.perf_counter() - start
+
+    for i in range(args['repeat']):
+        start = time.perf_counter()
+        failed = analysis.run_analysis(**kwargs)
+        elapsed = time.perf_counter() - start
+
+        print(f'Run {i + 1}/{args["repeat"]}: {elapsed:.3f} s '
+              f'({elapsed / max(len(analysis.station_tables), 1):.3f} s per station, setup {setup:.3f} s)')
+
+        if failed:
+            print(f'{failed} work units failed, see the log')
+            return 1
+
+    return 0
+
+
+def build_parser() -> ArgumentParser:
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
-    parser.add_argument('-ds', '--download_station_dataset', type=str, default=None,
-                        help=f"Download all station tables based on the {config['standard_station_download_param']}")
-    parser.add_argument('-dg', '--download_try_dataset', type=str, default=None,
-                        help='Download the TRY dataset for a given period. Formal must be \"<from year>-<to year>\"')
-    args = vars(parser.parse_args())
+    parser.add_argument('--config', type=str, default='config.yaml', help='Path to the config file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    download_stations = subparsers.add_parser('download-stations', formatter_class=ArgumentDefaultsHelpFormatter,
+                                              help='Download all station tables based on the standard download '
+                                                   'parameter of the config (e.g. Bundesland)')
+    download_stations.add_argument('value', type=str, help='Value of the download parameter, e.g. \"Niedersachsen\"')
+    download_stations.set_defaults(func=cmd_download_stations)
+
+    download_try = subparsers.add_parser('download-try', formatter_class=ArgumentDefaultsHelpFormatter,
+                                         help='Download the TRY dataset for a given period')
+    download_try.add_argument('period', type=period, help='Period formatted as \"<from YYYYMM>-<to YYYYMM>\"')
+    download_try.set_defaults(func=cmd_download_try)
+
+    analysis_parser = ArgumentParser(add_help=False)
+    analysis_parser.add_argument('--analysis', type=str, choices=ANALYSES, default='spatial',
+                                 help='Analysis to perform')
+    analysis_parser.add_argument('--try_path', type=str, default=__DATA_PATH + 'TRY/',
+                                 help='Directory of the monthly TRY NetCDF files')
+    analysis_parser.add_argument('--result_path', type=str, default=__DATA_PATH + 'result.feather',
+                                 help='Output path of the analysis result')
+    analysis_parser.add_argument('--stations', type=str, nargs='*', default=None,
+                                 help='Station tables to analyze, all station tables if omitted')
+    analysis_parser.add_argument('--max_days', type=int, default=None,
+                                 help='Fixed days per time chunk, a whole month if omitted')
+    analysis_parser.add_argument('--raw_station_data', action='store_true',
+                                 help='Resample the 10-minute station rows instead of reading the hourly tables')
+    analysis_parser.add_argument('--memory_budget_mb', type=int, default=None,
+                                 help='Memory budget per time chunk, derives the chunk length and overrides --max_days')
+    analysis_parser.add_argument('--thread_count', type=int, default=8, help='Threads used for the ring analysis')
+    analysis_parser.add_argument('--radius_start', type=float, default=0, help='Inner radius of the first ring')
+    analysis_parser.add_argument('--radius_end', type=float, default=50000, help='Outer radius of the last ring')
+    analysis_parser.add_argument('--radius_step', type=float, default=5000, help='Width of each ring')
+    analysis_parser.add_argument('--field_radius', type=float, default=None,
+                                 help='Radius of the cached metric fields (spatial analysis only), set it to the '
+                                      'largest --radius_end of a sweep so every run reuses them, --radius_end if '
+                                      'omitted')
+    analysis_parser.add_argument('--sector_count', type=int, default=8,
+                                 help='Number of direction sectors (directional analysis only)')
+    analysis_parser.add_argument('--metrics', type=str, nargs='+', default=['RMSE', 'MAPE'],
+                                 help='Metrics to calculate: MAE, MAPE, MSE, RMSE, the spatial analysis also '
+                                      'takes mean_/median_/std_ of these per ring')
+    analysis_parser.add_argument('--cache_path', type=str, default=__DATA_PATH + 'cache/',
+                                 help='Directory of the on-disk metric field cache')
+    analysis_parser.add_argument('--cache_memory_mb', type=int, default=512, help='Size of the in-memory field cache')
+    analysis_parser.add_argument('--cache_disk_mb', type=int, default=8192, help='Size of the on-disk field cache')
+    analysis_parser.add_argument('--shard_dir', type=str, default=None,
+                                 help='Shared work queue directory, run as sharded worker if set')
+    analysis_parser.add_argument('--workers', type=int, default=1,
+                                 help='Local worker processes claiming from --shard_dir')
+
+    analyze = subparsers.add_parser('analyze', parents=[analysis_parser], formatter_class=ArgumentDefaultsHelpFormatter,
+                                    help='Run an analysis of the station tables against the TRY dataset')
+    analyze.set_defaults(func=cmd_analyze)
+
+    bench = subparsers.add_parser('bench', parents=[analysis_parser], formatter_class=ArgumentDefaultsHelpFormatter,
+                                  help='Time an analysis run')
+    bench.add_argument('--repeat', type=int, default=1, help='Number of timed runs')
+    bench.set_defaults(func=cmd_bench)
+
+    merge = subparsers.add_parser('merge', formatter_class=ArgumentDefaultsHelpFormatter,
+                                  help='Merge the unit results of a sharded analysis')
+    merge.add_argument('shard_dir', type=str, help='Shared work queue directory')
+    merge.add_argument('--result_path', type=str, default=__DATA_PATH + 'result.feather',
+                       help='Output path of the merged result')
+    merge.add_argument('--allow_partial', action='store_true', help='Merge even if units are pending or failed')
+    merge.set_defaults(func=cmd_merge)
+
+    return parser
+
 
-    VALUE = args['download_station_dataset']
+def main(argv: list = None) -> int:
+    args = vars(build_parser().parse_args(argv))
 
-    from_to = str(args['download_try_dataset']).split(sep='-')
-    FROM = int(from_to[0])
-    TO = int(from_to[1])
+    config = load_config(path=args['config'])
 
     con = None
     try:
         con = sql.connect(database=__DATA_PATH + config['station_wind_speed_db_name'])
 
-        if VALUE is not None:
-            download_station_data(con=con, config=config, download_param=config['standard_station_download_param'], value=VALUE)
-        if FROM is not None and TO is not None:
-            download_grid_data(config=config, FROM=FROM, TO=TO)
+        return_code = args['func'](con=con, config=config, args=args)
 
     except Exception as e:
+        logging.exception(e)
         print(e)
+        return 1
 
     finally:
         if con:
             con.close()
 
-    pass
+    return return_code or 0
 
 
 if __name__ == '__main__':
@@ -70,4 +288,4 @@ if __name__ == '__main__':
                         datefmt='%H:%M:%S',
                         level=logging.INFO)
 
-    main()
\ No newline at end of file
+    sys.exit(main())
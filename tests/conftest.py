@@ -0,0 +1,66 @@
+import os
+import sys
+import sqlite3 as sql
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STATION_ID = 1
+STATION_LAT = 50.0 + 10000 / 111000
+STATION_LON = 7.0 + 10000 / 71000
+
+
+def make_try(hours: int = 48, size: int = 21, seed: int = 0) -> xr.Dataset:
+    # 1 km grid like TRY, lat only depends on Y and lon only on X
+    X = np.arange(size) * 1000.0
+    Y = np.arange(size) * 1000.0
+    time = pd.date_range('2020-01-01', periods=hours, freq='h')
+
+    rng = np.random.default_rng(seed)
+    ff = rng.random((hours, size, size)) * 10
+
+    return xr.Dataset(dict(FF=(['time', 'Y', 'X'], ff),
+                           lat=(['Y', 'X'], np.repeat(50.0 + Y[:, np.newaxis] / 111000, size, axis=1)),
+                           lon=(['Y', 'X'], np.repeat(7.0 + X[np.newaxis, :] / 71000, size, axis=0))),
+                      coords=dict(time=time, Y=Y, X=X))
+
+
+def make_station(hours: int = 48, seed: int = 1) -> pd.DataFrame:
+    time = pd.date_range('2020-01-01', periods=hours, freq='h')
+
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(dict(FF_10=rng.random(hours) * 10 + 0.5, DD_10=rng.random(hours) * 360), index=time)
+    df.iloc[3, df.columns.get_loc('FF_10')] = np.nan
+    df.iloc[5, df.columns.get_loc('DD_10')] = np.nan
+
+    return df
+
+
+@pytest.fixture
+def connection():
+    con = sql.connect(':memory:')
+    con.execute('CREATE TABLE Beschreibung_Stationen (Stations_id INTEGER PRIMARY KEY, geoBreite FLOAT, '
+                'geoLaenge FLOAT)')
+    con.execute('INSERT INTO Beschreibung_Stationen VALUES (?, ?, ?)', (STATION_ID, STATION_LAT, STATION_LON))
+    con.commit()
+
+    yield con
+
+    con.close()
+
+
+@pytest.fixture
+def parameters(connection, tmp_path):
+    return dict(connection=connection,
+                TRY_path=str(tmp_path) + '/',
+                result_path=str(tmp_path / 'result.feather'),
+                station_tables=[],
+                thread_count=1)
+
+
+def func_param(ds: xr.Dataset, df: pd.DataFrame) -> dict:
+    return dict(ds=ds, df=df, longitude=STATION_LON, latitude=STATION_LAT, station_id=STATION_ID)
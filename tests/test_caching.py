@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import xarray as xr
+
+from DataAnalysis.caching import MetricFieldCache, content_key
+
+
+def make_field(seed: int) -> xr.Dataset:
+    rng = np.random.default_rng(seed)
+    return xr.Dataset(dict(sum=(['Y', 'X'], rng.random((8, 8))), count=(['Y', 'X'], np.full((8, 8), 3))))
+
+
+def test_disk_is_scanned_only_when_full(tmp_path, monkeypatch):
+    cache = MetricFieldCache(path=str(tmp_path), max_memory_bytes=0)
+
+    scans = []
+    disk_entries = cache._disk_entries
+    monkeypatch.setattr(cache, '_disk_entries', lambda: scans.append(1) or disk_entries())
+
+    for i in range(5):
+        cache.put(key=content_key(i), field=make_field(seed=i))
+    assert not scans
+
+    size = os.path.getsize(cache._file(content_key(0)))
+    cache.max_disk_bytes = 5.5 * size
+    cache.put(key=content_key(5), field=make_field(seed=5))
+
+    # one scan evicts the oldest entries down to the low water mark
+    assert len(scans) == 1
+    assert len(os.listdir(tmp_path)) == int(cache.max_disk_bytes * cache.disk_low_water // size)
+    assert cache._disk_bytes == sum(os.path.getsize(tmp_path / file) for file in os.listdir(tmp_path))
+
+
+def test_running_total_is_seeded_from_disk(tmp_path):
+    cache = MetricFieldCache(path=str(tmp_path))
+    cache.put(key=content_key(0), field=make_field(seed=0))
+
+    reopened = MetricFieldCache(path=str(tmp_path))
+    assert reopened._disk_bytes == cache._disk_bytes > 0
+
+    xr.testing.assert_identical(reopened.get(key=content_key(0)), make_field(seed=0))
+    assert (reopened.hits, reopened.misses) == (1, 0)
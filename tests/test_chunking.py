@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+
+from DataAnalysis.analysis import SpatialAnalysis, DirectionalAnalysis
+
+from conftest import STATION_ID, make_station, make_try, func_param as make_func_param
+
+TRY_FILE = 'TRY202001_test.nc'
+
+
+@pytest.fixture
+def station_parameters(parameters):
+    df = make_station().rename_axis('time').reset_index()
+    df.insert(0, 'STATIONS_ID', STATION_ID)
+    df['timestamp'] = (df['time'] - pd.Timestamp('1970-01-01')) // pd.Timedelta(seconds=1)
+    df['time'] = df['time'].astype(str)
+    df.to_sql(name='Station_1', con=parameters['connection'], index=False)
+
+    return dict(parameters, station_tables=['Station_1'])
+
+
+def run_station(analysis, kwargs):
+    results = []
+    analysis.prepare_metrics(metrics=kwargs['metrics'])
+    analysis.analyze_station(analysis.spatial_analysis if type(analysis) is SpatialAnalysis
+                             else analysis.directional_analysis,
+                             lambda result, parameters: results.append(analysis.after_each_station(result, parameters)),
+                             make_try(), TRY_FILE, 'Station_1', kwargs)
+
+    return results[0]
+
+
+@pytest.mark.parametrize('analysis_class', [SpatialAnalysis, DirectionalAnalysis])
+def test_chunked_month_equals_whole_month(station_parameters, analysis_class):
+    kwargs = dict(metrics=['RMSE', 'MAPE'], radius_start=0, radius_end=6000, radius_step=2000, sector_count=4,
+                  result_path=station_parameters['result_path'])
+
+    whole = run_station(analysis_class(parameters=station_parameters), kwargs)
+
+    analysis = analysis_class(parameters=station_parameters)
+    analysis.prepare_metrics(metrics=kwargs['metrics'])
+    cells = 11 * 11
+    budget = 5 * cells * 8 * (analysis.base_arrays + analysis.arrays_per_metric * 2)
+    chunked = run_station(analysis, dict(kwargs, memory_budget=budget))
+
+    pd.testing.assert_frame_equal(whole, chunked)
+
+
+def test_budget_counts_window(station_parameters):
+    analysis = SpatialAnalysis(parameters=station_parameters)
+    analysis.prepare_metrics(metrics=['RMSE'])
+
+    func_param = make_func_param(make_try(), make_station())
+
+    kwargs = dict(radius_end=6000, memory_budget=2 ** 20)
+    cells = analysis.estimate_cells(func_param=func_param, kwargs=kwargs)
+
+    assert cells == 11 * 11
+    assert analysis.calc_chunk_hours(func_param=func_param, kwargs=kwargs) == 2 ** 20 // (cells * 8 * (6 + 3))
+
+
+def test_run_analysis_writes_all_units_and_counts_failures(station_parameters, tmp_path):
+    make_try().to_netcdf(tmp_path / TRY_FILE)
+    make_try().to_netcdf(tmp_path / 'TRY202002_test.nc')
+
+    analysis = SpatialAnalysis(parameters=dict(station_parameters, station_tables=['Station_1', 'Station_2']))
+    kwargs = dict(metrics=['RMSE'], radius_start=0, radius_end=6000, radius_step=2000,
+                  result_path=station_parameters['result_path'])
+
+    # Station_2 does not exist, both of its units fail
+    assert analysis.run_analysis(**kwargs) == 2
+
+    df_result = pd.read_feather(station_parameters['result_path'])
+    assert list(df_result[['station_table', 'try_file']].drop_duplicates().itertuples(index=False, name=None)) == \
+           [('Station_1', TRY_FILE)]
+    assert len(df_result) == 2
@@ -0,0 +1,93 @@
+import zipfile
+import sqlite3 as sql
+from io import BytesIO
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import DataProcurement.procurement as procurement
+from DataProcurement.procurement import ingestStationZip, ingestStationDataset
+from DataAnalysis.analysis import SpatialAnalysis
+
+
+def make_zip(rows: int = 100, start: str = '2020-03-01 00:00') -> bytes:
+    time = pd.date_range(start, periods=rows, freq='10min')
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'STATIONS_ID': 1,
+                       'MESS_DATUM': time.strftime('%Y%m%d%H%M'),
+                       '  QN': 3,
+                       'FF_10': np.round(rng.random(rows) * 10, 1),
+                       'DD_10': rng.integers(0, 360, rows),
+                       'eor': 'eor'})
+    df.loc[4, 'FF_10'] = -999
+    df.loc[7, 'DD_10'] = -999
+
+    content = BytesIO()
+    with zipfile.ZipFile(content, mode='w') as files:
+        files.writestr('produkt_zehn_min_ff_20200301_20200301_00001.txt', df.to_csv(sep=';', index=False))
+
+    return content.getvalue()
+
+
+def read_hourly(chunk_size: int) -> pd.DataFrame:
+    con = sql.connect(':memory:')
+    ingestStationZip(zip_content=make_zip(), connection=con, table_name='Station00001', chunk_size=chunk_size)
+
+    df = pd.read_sql(sql='SELECT * FROM Station00001_hourly ORDER BY time', con=con)
+    con.close()
+
+    return df
+
+
+def test_chunks_split_hours_same_rows():
+    whole = read_hourly(chunk_size=100000)
+
+    # 7 rows per chunk, every hour of 6 rows is split across two chunks at some point
+    pd.testing.assert_frame_equal(read_hourly(chunk_size=7), whole)
+
+    assert len(whole) == 17
+    assert whole['FF_10_count'].iloc[0] == 5
+    assert whole['timestamp'].iloc[1] == pd.Timestamp('2020-03-01 01:00', tz='UTC').timestamp()
+
+
+def test_downloads_are_prefetched_bounded(monkeypatch):
+    files = [f'file{i}.zip' for i in range(10)]
+    lock = Lock()
+    state = dict(ahead=0, max_ahead=0)
+
+    def download(file_url):
+        with lock:
+            state['ahead'] += 1
+            state['max_ahead'] = max(state['max_ahead'], state['ahead'])
+        return file_url
+
+    def ingest(zip_content, connection, table_name):
+        with lock:
+            state['ahead'] -= 1
+        return 1
+
+    monkeypatch.setattr(procurement, 'getAllDatasource', lambda url, station_id: files)
+    monkeypatch.setattr(procurement, 'downloadZip', download)
+    monkeypatch.setattr(procurement, 'ingestStationZip', ingest)
+
+    con = sql.connect(':memory:')
+    assert ingestStationDataset(url='', station_id=1, connection=con, table_name='Station00001', prefetch=3) == 10
+    con.close()
+    assert state['max_ahead'] <= 3
+
+
+@pytest.mark.parametrize('raw_station_data', [False, True])
+def test_load_station_reads_only_the_month(connection, parameters, raw_station_data):
+    # 31.01. 20:00 to 01.02. 03:50
+    ingestStationZip(zip_content=make_zip(rows=48, start='2020-01-31 20:00'), connection=connection,
+                     table_name='Station00001')
+
+    analysis = SpatialAnalysis(parameters=dict(parameters, raw_station_data=raw_station_data))
+    time_start, time_end = analysis.calc_time_step(try_filename='TRY202001.nc')
+
+    df = analysis.load_station(table='Station00001', time_start=time_start, time_end=time_end)
+
+    assert list(df.index) == list(pd.date_range('2020-01-31 20:00', periods=4, freq='h'))
@@ -0,0 +1,17 @@
+from argparse import ArgumentTypeError
+
+import pytest
+
+from main import period
+
+
+def test_period_parses_months():
+    assert period('201001-201912') == (201001, 201912)
+    assert period('202005-202005') == (202005, 202005)
+
+
+@pytest.mark.parametrize('value', ['2020-2021', '20200-202012', '202013-202101', '202000-202001',
+                                   '202001', '202001-202002-202003', 'abcdef-202001', '202012-202001'])
+def test_period_rejects_invalid(value):
+    with pytest.raises(ArgumentTypeError):
+        period(value)
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from conftest import make_try, make_station, func_param
+from DataAnalysis.analysis import DirectionalAnalysis
+from DataAnalysis.utilities import calc_sector, calc_ring, calc_polar_labels, grouped_sum, calc_polar_coordinates
+
+
+def test_calc_sector_is_centred_on_north():
+    assert list(calc_sector([0, 22.4, 22.6, 337.6, 359.9, 90], sector_count=8)) == [0, 0, 1, 0, 0, 2]
+
+
+def test_calc_sector_wraps_at_360_and_marks_nan():
+    assert list(calc_sector([360, 720, -10, np.nan], sector_count=4)) == [0, 0, 0, -1]
+
+
+def test_calc_ring_edges():
+    rings = calc_ring(distances=np.array([0, 999, 1000, 2999, 3000, 5000]), radius_edges=[0, 1000, 2000, 3000])
+    assert list(rings) == [0, 0, 1, 2, -1, -1]
+
+
+def test_calc_ring_inner_radius():
+    assert list(calc_ring(distances=np.array([500, 1000]), radius_edges=[1000, 2000])) == [-1, 0]
+
+
+def test_calc_polar_coordinates_bearing():
+    ds = make_try(hours=1, size=3)
+    distances, bearings = calc_polar_coordinates(dwd_ds=ds, x=1000.0, y=1000.0)
+
+    assert distances[1, 1] == 0
+    assert bearings[2, 1] == 0
+    assert bearings[1, 2] == 90
+    assert bearings[0, 1] == 180
+    assert bearings[1, 0] == 270
+
+
+def test_calc_polar_labels():
+    distances = np.array([[500, 1500], [1500, 2500]])
+    bearings = np.array([[0, 90], [180, 270]])
+
+    labels = calc_polar_labels(distances=distances, bearings=bearings, radius_edges=[0, 1000, 2000], sector_count=4)
+    assert labels.tolist() == [[0, 3], [5, -1]]
+
+
+def test_grouped_sum_skips_invalid():
+    sums, counts = grouped_sum(values=[1.0, 2.0, np.nan, np.inf, 5.0], labels=[0, 1, 1, 0, -1], group_count=3)
+
+    assert sums.tolist() == [1.0, 2.0, 0.0]
+    assert counts.tolist() == [1, 1, 0]
+
+
+def test_directional_unconditioned_equals_pooled_wind_sectors(parameters):
+    analysis = DirectionalAnalysis(parameters=parameters)
+    analysis.prepare_metrics(metrics=['MAE', 'RMSE'])
+
+    kwargs = dict(radius_start=0, radius_end=8000, radius_step=2000, sector_count=4,
+                  result_path=parameters['result_path'])
+    ds, df = make_try(), make_station()
+
+    result = analysis.directional_analysis(func_param(ds=ds, df=df), kwargs)
+    df_result = analysis.after_each_station(result, kwargs)
+
+    shape = (5, 4, 3)
+    sums = result['MAE_sum'].reshape(shape)
+    counts = result['MAE_count'].reshape(shape)
+
+    unconditioned = df_result.loc[df_result['wind_sector'] == -1, 'MAE'].values
+    np.testing.assert_allclose(unconditioned, (sums.sum(axis=0) / counts.sum(axis=0)).ravel())
+
+    # pooled RMSE is the root of the pooled mean square deviation, not a mean of roots
+    assert (df_result['RMSE'] >= df_result['MAE'] - 1e-12).all()
+    assert counts.sum() == result['RMSE_count'].sum()
+
+
+def test_directional_rejects_per_cell_metrics(parameters):
+    analysis = DirectionalAnalysis(parameters=parameters)
+
+    with pytest.raises(ValueError):
+        analysis.prepare_metrics(metrics=['mean_RMSE'])
+
+
+def test_unknown_metric_raises_value_error(parameters):
+    with pytest.raises(ValueError):
+        DirectionalAnalysis(parameters=parameters).prepare_metrics(metrics=['XYZ'])
+
+
+def test_caches_are_per_instance(parameters):
+    first, second = DirectionalAnalysis(parameters=parameters), DirectionalAnalysis(parameters=parameters)
+
+    assert first._polar_index is not second._polar_index
+    assert first._windows is not second._windows
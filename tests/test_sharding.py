@@ -0,0 +1,77 @@
+import os
+import time
+import multiprocessing
+
+import pandas as pd
+
+from DataAnalysis.sharding import WorkQueue, run_worker, DONE, FAILED, PENDING, RUNNING
+
+TABLES = [f'Station_{i}' for i in range(6)] + ['Station_empty']
+TRY_FILES = ['TRY202001.nc', 'TRY202002.nc', 'TRY202003.nc']
+
+
+def run_unit(table: str, try_file: str, result_path: str) -> bool:
+    with open(os.path.join(os.path.dirname(os.path.dirname(result_path)), 'log.txt'), 'a') as log:
+        log.write(f'{table} {try_file}\n')
+
+    if table == 'Station_empty':
+        return False
+
+    pd.DataFrame(dict(radius=[1000.0], RMSE=[float(len(table))])).to_feather(path=result_path)
+    return True
+
+
+def worker(shard_dir: str) -> None:
+    run_worker(queue=WorkQueue(shard_dir=shard_dir), run_unit=run_unit)
+
+
+def test_workers_run_every_unit_once(tmp_path):
+    queue = WorkQueue(shard_dir=str(tmp_path))
+    assert queue.populate(station_tables=TABLES, try_files=TRY_FILES) == len(TABLES) * len(TRY_FILES)
+    assert queue.populate(station_tables=TABLES, try_files=TRY_FILES) == 0
+
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=worker, args=(str(tmp_path),)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+
+    with open(tmp_path / 'log.txt') as log:
+        units = log.read().splitlines()
+
+    assert sorted(units) == sorted(f'{table} {try_file}' for table in TABLES for try_file in TRY_FILES)
+    assert queue.status()[DONE] == len(TABLES) * len(TRY_FILES)
+
+    # units without a result are done but have no rows in the merge
+    df_result = queue.merge(result_path=str(tmp_path / 'result.feather'))
+    assert len(df_result) == (len(TABLES) - 1) * len(TRY_FILES)
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue = WorkQueue(shard_dir=str(tmp_path), lease_seconds=0.05)
+    queue.populate(station_tables=['Station_1'], try_files=['TRY202001.nc'])
+
+    unit = queue.claim(worker='dead')
+    assert queue.claim(worker='alive') is None
+
+    time.sleep(0.1)
+    assert queue.claim(worker='alive') == unit
+
+    # the worker which lost its lease can not complete the unit anymore
+    assert not queue.complete(unit_id=unit[0], worker='dead', result_path='dead.feather')
+    assert queue.complete(unit_id=unit[0], worker='alive')
+
+
+def test_expired_lease_fails_after_max_attempts(tmp_path):
+    queue = WorkQueue(shard_dir=str(tmp_path), lease_seconds=0.05, max_attempts=2)
+    queue.populate(station_tables=['Station_1'], try_files=['TRY202001.nc'])
+
+    for _ in range(2):
+        assert queue.claim(worker='dead') is not None
+        time.sleep(0.1)
+
+    assert queue.claim(worker='alive') is None
+    assert queue.status() == {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 1}
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from DataAnalysis.analysis import SpatialAnalysis
+from DataAnalysis.utilities import calc_square_deviation, station_to_dwd_grid, to_coordinate
+
+from conftest import STATION_LAT, STATION_LON, func_param, make_station, make_try
+
+
+def run_station(analysis, ds, df, kwargs):
+    analysis.prepare_metrics(metrics=kwargs['metrics'])
+    result = analysis.spatial_analysis(func_param(ds, df), kwargs)
+
+    return analysis.after_each_station(result, kwargs)
+
+
+def test_rows_per_ring(parameters):
+    kwargs = dict(metrics=['RMSE', 'MAE', 'mean_RMSE', 'median_MAPE'], radius_start=0, radius_end=6000,
+                  radius_step=2000, result_path=parameters['result_path'])
+
+    df_result = run_station(SpatialAnalysis(parameters=parameters), make_try(), make_station(), kwargs)
+
+    assert list(df_result['radius']) == [2000, 4000]
+    assert list(df_result['radius_inner']) == [0, 2000]
+    assert not df_result[kwargs['metrics']].isna().any().any()
+
+
+def test_ring_rmse_matches_brute_force(parameters):
+    ds, df = make_try(), make_station()
+    kwargs = dict(metrics=['RMSE', 'mean_RMSE'], radius_start=0, radius_end=6000, radius_step=2000,
+                  result_path=parameters['result_path'])
+
+    df_result = run_station(SpatialAnalysis(parameters=parameters), ds, df, kwargs)
+
+    grid = station_to_dwd_grid(df=df, lat_station=STATION_LAT, lon_station=STATION_LON, dwd_ds=ds, radius=6000)
+    se = calc_square_deviation(ds['FF'], grid['FF'], 'X', 'Y')['SE'].values
+
+    x, y = to_coordinate(lat_station=STATION_LAT, lon_station=STATION_LON, dwd_ds=ds)
+    distances = np.hypot(ds['X'].values[np.newaxis, :] - x, ds['Y'].values[:, np.newaxis] - y)
+    ring = (distances >= 2000) & (distances < 4000)
+
+    cell_mse = np.nanmean(se, axis=0)[ring]
+
+    assert np.isclose(df_result['RMSE'].iloc[1], np.sqrt(np.mean(cell_mse)))
+    assert np.isclose(df_result['mean_RMSE'].iloc[1], np.mean(np.sqrt(cell_mse)))
+
+
+def test_radius_sweep_hits_cache(parameters):
+    ds, df = make_try(), make_station()
+    analysis = SpatialAnalysis(parameters=parameters)
+    kwargs = dict(metrics=['RMSE', 'mean_MSE', 'MAPE'], radius_start=0, radius_end=6000,
+                  result_path=parameters['result_path'])
+
+    first = run_station(analysis, ds, df, dict(kwargs, radius_step=2000))
+    misses = analysis.metric_cache.misses
+
+    second = run_station(analysis, ds, df, dict(kwargs, radius_step=1000))
+
+    # both runs share the square deviation field, the second run computes nothing
+    assert misses == 2
+    assert analysis.metric_cache.misses == misses
+    assert analysis.metric_cache.hits == 2
+    assert len(first) == 2 and len(second) == 5
+
+
+def test_outer_radius_sweep_hits_cache_with_field_radius(parameters):
+    ds, df = make_try(), make_station()
+    analysis = SpatialAnalysis(parameters=parameters)
+    kwargs = dict(metrics=['RMSE', 'mean_MAE'], radius_start=0, radius_step=2000, field_radius=8000,
+                  result_path=parameters['result_path'])
+
+    inner = run_station(analysis, ds, df, dict(kwargs, radius_end=6000))
+    misses = analysis.metric_cache.misses
+
+    outer = run_station(analysis, ds, df, dict(kwargs, radius_end=8000))
+
+    assert analysis.metric_cache.misses == misses
+    assert len(inner) == 2 and len(outer) == 3
+
+    # a larger field does not change the rings it shares with a field of radius_end
+    plain = run_station(SpatialAnalysis(parameters=parameters), ds, df, dict(kwargs, radius_end=6000,
+                                                                              field_radius=None))
+    pd.testing.assert_frame_equal(inner, plain)
+    pd.testing.assert_frame_equal(outer.iloc[:2], plain)
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import DataAnalysis.utilities as utilities
+
+from DataProcurement.procurement import rechunkNCs
+from DataAnalysis.utilities import calc_window, extract_station_windows, to_coordinate
+
+from conftest import STATION_LAT, STATION_LON, make_try
+
+
+def write_month(path, start: str, hours: int = 24, seed: int = 0, size: int = 21) -> xr.Dataset:
+    ds = make_try(hours=hours, size=size, seed=seed).assign_coords(time=pd.date_range(start, periods=hours, freq='h'))
+    ds.to_netcdf(path / f'TRY{start[:4]}{start[5:7]}.nc')
+
+    return ds
+
+
+def read_store(store_path) -> xr.Dataset:
+    return xr.load_dataset(store_path)
+
+
+def test_rechunk_appends_new_months_and_skips_known_ones(tmp_path):
+    path, store_path = tmp_path / 'TRY', str(tmp_path / 'store.nc')
+    path.mkdir()
+
+    months = [write_month(path, '2020-01-01', seed=0), write_month(path, '2020-02-01', seed=1)]
+    assert rechunkNCs(path=str(path) + '/', store_path=store_path) == 2
+    assert rechunkNCs(path=str(path) + '/', store_path=store_path) == 0
+
+    months.append(write_month(path, '2020-03-01', seed=2))
+    assert rechunkNCs(path=str(path) + '/', store_path=store_path) == 1
+
+    store = read_store(store_path)
+    expected = xr.concat([ds['FF'] for ds in months], dim='time')
+
+    np.testing.assert_array_equal(store['time'].values, expected['time'].values)
+    np.testing.assert_allclose(store['FF'].values, expected.values.astype(np.float32))
+
+
+def test_rechunk_rebuilds_for_older_month(tmp_path):
+    path, store_path = tmp_path / 'TRY', str(tmp_path / 'store.nc')
+    path.mkdir()
+
+    months = [write_month(path, '2020-02-01', seed=1)]
+    rechunkNCs(path=str(path) + '/', store_path=store_path)
+
+    months.insert(0, write_month(path, '2020-01-01', seed=0))
+    assert rechunkNCs(path=str(path) + '/', store_path=store_path) == 2
+
+    store = read_store(store_path)
+    expected = xr.concat([ds['FF'] for ds in months], dim='time')
+
+    np.testing.assert_array_equal(store['time'].values, expected['time'].values)
+    np.testing.assert_allclose(store['FF'].values, expected.values.astype(np.float32))
+
+
+def test_station_windows_are_slices_of_the_store(tmp_path):
+    path, store_path = tmp_path / 'TRY', str(tmp_path / 'store.nc')
+    path.mkdir()
+
+    write_month(path, '2020-01-01', hours=48)
+    rechunkNCs(path=str(path) + '/', store_path=store_path)
+
+    stations = {1: (STATION_LAT, STATION_LON), 2: (STATION_LAT + 6000 / 111000, STATION_LON - 8000 / 71000)}
+    time_start, time_end = np.datetime64('2020-01-01T06'), np.datetime64('2020-01-02T05')
+
+    windows = extract_station_windows(store_path=store_path, stations=stations, radius=4000,
+                                      time_start=time_start, time_end=time_end)
+
+    store = read_store(store_path)
+    for station_id, (lat, lon) in stations.items():
+        x, y = to_coordinate(lat_station=lat, lon_station=lon, dwd_ds=store)
+        expected = store.isel(calc_window(dwd_ds=store, x=x, y=y, radius=4000)).sel(time=slice(time_start, time_end))
+
+        assert windows[station_id].sizes == expected.sizes
+        xr.testing.assert_identical(windows[station_id], expected)
+
+
+def test_distant_station_windows_read_only_their_tiles(tmp_path, monkeypatch):
+    path, store_path = tmp_path / 'TRY', str(tmp_path / 'store.nc')
+    path.mkdir()
+
+    write_month(path, '2020-01-01', hours=24, size=41)
+    rechunkNCs(path=str(path) + '/', store_path=store_path, chunk_size=4)
+
+    read = []
+    read_tile = utilities.read_tile
+
+    def record_tile(da, time, y, x):
+        read.append((y, x))
+        return read_tile(da=da, time=time, y=y, x=x)
+
+    monkeypatch.setattr(utilities, 'read_tile', record_tile)
+
+    # opposite corners of the grid, their bounding box would be the whole grid
+    stations = {1: (50.0 + 2000 / 111000, 7.0 + 2000 / 71000), 2: (50.0 + 38000 / 111000, 7.0 + 38000 / 71000)}
+    windows = extract_station_windows(store_path=store_path, stations=stations, radius=3000)
+
+    store = read_store(store_path)
+    cells = set()
+    for station_id, (lat, lon) in stations.items():
+        x, y = to_coordinate(lat_station=lat, lon_station=lon, dwd_ds=store)
+        window = calc_window(dwd_ds=store, x=x, y=y, radius=3000)
+        xr.testing.assert_identical(windows[station_id], store.isel(window))
+
+        cells |= {(j // 4, i // 4) for j in range(window['Y'].start, window['Y'].stop)
+                  for i in range(window['X'].start, window['X'].stop)}
+
+    # only the 4x4 tiles covering a window are read, each of them once
+    assert sorted((y.start // 4, x.start // 4) for y, x in read) == sorted(cells)
@@ -0,0 +1,44 @@
+import numpy as np
+
+from conftest import make_try, make_station, func_param, STATION_LAT, STATION_LON
+from DataAnalysis.analysis import SpatialAnalysis
+from DataAnalysis.utilities import calc_window, to_coordinate, station_to_dwd_grid, calc_mean_square_deviation
+
+
+def test_calc_window_covers_radius():
+    ds = make_try(hours=1)
+    window = calc_window(dwd_ds=ds, x=10000.0, y=10000.0, radius=3000)
+
+    assert window == dict(X=slice(8, 13), Y=slice(8, 13))
+
+
+def test_calc_window_is_clipped_at_grid_edge():
+    ds = make_try(hours=1)
+    window = calc_window(dwd_ds=ds, x=1000.0, y=10000.0, radius=3000)
+
+    assert window == dict(X=slice(0, 4), Y=slice(8, 13))
+
+
+def test_cropped_metric_equals_full_grid_metric(parameters):
+    # station close to the western edge, so the window is not square
+    ds, df = make_try(), make_station()
+    ds = ds.assign(lon=ds['lon'] + 8000 / 71000)
+    radius = 5000
+
+    analysis = SpatialAnalysis(parameters=parameters)
+    ds_window, x, y = analysis.crop_to_station(func_param=func_param(ds=ds, df=df), radius=radius)
+    assert ds_window.sizes['X'] != ds_window.sizes['Y']
+
+    full_grid = station_to_dwd_grid(df=df, lat_station=STATION_LAT, lon_station=STATION_LON, dwd_ds=ds, radius=radius)
+    full = calc_mean_square_deviation(ds['FF'], full_grid['FF'], 'X', 'Y')
+
+    window_grid = station_to_dwd_grid(df=df, lat_station=STATION_LAT, lon_station=STATION_LON, dwd_ds=ds_window,
+                                      radius=radius)
+    cropped = calc_mean_square_deviation(ds_window['FF'], window_grid['FF'], 'X', 'Y')
+
+    assert (x, y) == to_coordinate(lat_station=STATION_LAT, lon_station=STATION_LON, dwd_ds=ds)
+    np.testing.assert_allclose(cropped['MSE'].values, full['MSE'].sel(X=cropped['X'], Y=cropped['Y']).values)
+
+    # every cell within the radius lies inside the window
+    outside = full['MSE'].drop_sel(X=cropped['X'].values)
+    assert np.isnan(outside.values).all()